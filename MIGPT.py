@@ -1,19 +1,28 @@
 #!/usr/bin/env python3
 import asyncio
-import json
+import contextlib
+import logging
 import os
-import subprocess
 from http.cookies import SimpleCookie
 from pathlib import Path
-import threading
-import time
-from aiohttp import ClientSession
+from aiohttp import ClientError
+from commandtts import CommandTTS
+from deviceregistry import DeviceRegistry
+from httppool import TIMEOUTS, PoolStats, create_session
+from journal import ConversationJournal
+from llmpool import Backend
 from minaservice import MiNAService
 from miaccount import MiAccount
-from requests.utils import cookiejar_from_dict
-from V3 import Chatbot
+from segmenter import SentenceSegmenter
+from statuswatcher import StatusWatcher
+from taskgroup import TaskGroup
+from ttsscheduler import TTSScheduler
+from tracing import Tracer
+from router import INTENT_COMMAND, INTENT_NATIVE, IntentRouter
+from resilience import MiRequestError
+from querypoller import QueryAuthError, QueryError, QueryPoller
+from V3 import DEFAULT_ENGINE, Chatbot, get_encoding
 
-LATEST_ASK_API = "https://userprofile.mina.mi.com/device_profile/v2/conversation?source=dialogu&hardware={hardware}&timestamp={timestamp}&limit=2"
 COOKIE_TEMPLATE = "deviceId={device_id}; serviceToken={service_token}; userId={user_id}"
 
 HARDWARE_COMMAND_DICT = {
@@ -35,34 +44,41 @@ MI_PASS = "你的小米账号密码"  # 小米账号密码
 OPENAI_API_KEY = "你的API KEY"  # openai的api key
 SOUND_TYPE = "你的音箱型号"  # 音箱型号
 
-# 检查必要的数据
-if MI_USER == "你的小米账号":
-    raise ValueError("请先在MIGPT.py中填写小米账号！")
-if MI_PASS == "你的小米账号密码":
-    raise ValueError("请先在MIGPT.py中填写小米账号密码！")
-if OPENAI_API_KEY == "你的API KEY":
-    raise ValueError("请先在MIGPT.py中填写openai的api key！")
-if SOUND_TYPE == "你的音箱型号":
-    raise ValueError("请先在MIGPT.py中填写音箱型号！")
-if SOUND_TYPE not in HARDWARE_COMMAND_DICT:
-    raise ValueError("{}不在型号列表中！请检查型号是否正确。".format(SOUND_TYPE))
-
 SWITCH = True  # 是否开启chatgpt回答
+INTENT_MODEL = ""  # 可选，意图分类模型文件（python router.py 训练），为空时除控制指令外都交给GPT
 PROMPT = "请用100字以内回答，第一句一定不要超过10个汉字或5个单词，并且请快速生成前几句话"  # 限制回答字数在100以内
 
-loop = asyncio.get_event_loop()
+_LOGGER = logging.getLogger(__package__)
 
 
 ### HELP FUNCTION ###
+def check_config(mi_user=None, mi_pass=None, api_key=None, hardware=None):
+    # 检查必要的数据
+    if (mi_user or MI_USER) == "你的小米账号":
+        raise ValueError("请先在MIGPT.py中填写小米账号！")
+    if (mi_pass or MI_PASS) == "你的小米账号密码":
+        raise ValueError("请先在MIGPT.py中填写小米账号密码！")
+    if (api_key or OPENAI_API_KEY) == "你的API KEY":
+        raise ValueError("请先在MIGPT.py中填写openai的api key！")
+    hardware = hardware or SOUND_TYPE
+    if hardware == "你的音箱型号":
+        raise ValueError("请先在MIGPT.py中填写音箱型号！")
+    if hardware not in HARDWARE_COMMAND_DICT:
+        raise ValueError("{}不在型号列表中！请检查型号是否正确。".format(hardware))
+
+
+def get_token_path(mi_user):
+    return os.path.join(Path.home(), "." + mi_user + ".mi.token")
+
+
+def get_devices_path(mi_user):
+    return os.path.join(Path.home(), "." + mi_user + ".mi.devices")
+
+
 def parse_cookie_string(cookie_string):
     cookie = SimpleCookie()
     cookie.load(cookie_string)
-    cookies_dict = {}
-    cookiejar = None
-    for k, m in cookie.items():
-        cookies_dict[k] = m.value
-        cookiejar = cookiejar_from_dict(cookies_dict, cookiejar=None, overwrite=True)
-    return cookiejar
+    return {k: m.value for k, m in cookie.items()}
 
 
 class MiGPT:
@@ -70,236 +86,390 @@ class MiGPT:
             self,
             hardware=SOUND_TYPE,
             use_command=False,
+            wait_times=3,
+            mi_user=None,
+            mi_pass=None,
+            api_key=None,
+            account=None,
+            switch=None,
+            tracer=None,
+            trace_file=None,
+            metrics_port=None,
+            answer_cache=None,
+            history_dir=None,
+            idle_timeout=600,
+            router=None,
+            command_tts=None,
+            tts_hedge_delay=None,
+            device_name=None,
+            device_registry=None,
+            llm_backends=None,
+            llm_hedge_delay=None,
+            summary_target_tokens=None,
     ):
-        self.mi_token_home = os.path.join(Path.home(), "." + MI_USER + ".mi.token")
+        self.mi_user = mi_user or MI_USER
+        self.mi_pass = mi_pass or MI_PASS
+        self.api_key = api_key or OPENAI_API_KEY
+        self.switch = SWITCH if switch is None else switch  # 是否开启chatgpt回答
+        self.mi_token_home = get_token_path(self.mi_user)
         self.hardware = hardware
+        self.device_name = device_name  # 同型号有多个音箱时按名称选择
+        self.device_registry = device_registry  # 同一账号的音箱共用
         self.cookie_string = ""
-        self.last_timestamp = 0  # timestamp last call mi speaker
         self.session = None
         self.chatbot = None  # a little slow to init we move it after xiaomi init
         self.user_id = ""
         self.device_id = ""
         self.service_token = ""
         self.cookie = ""
+        self.cookies = None
         self.use_command = use_command
+        self.wait_times = wait_times  # 前几个短句按逗号切分，之后按整句切分
         self.tts_command = HARDWARE_COMMAND_DICT.get(hardware, "5-1")
+        self.command_tts = None
+        if use_command:
+            # 异步启动micli，不阻塞轮询和打断检测
+            self.command_tts = command_tts or CommandTTS()
         self.conversation_id = None
         self.parent_id = None
-        self.miboy_account = None
+        self.account = account  # 多个音箱可以共用同一个账号
         self.mina_service = None
+        self.tts_hedge_delay = tts_hedge_delay  # TTS超过这么多秒未返回时再发一次，None为关闭
+        self.status_watcher = None
+        self.query_poller = None
+        self.pool_stats = PoolStats()  # 连接池统计，可随时查看
+        self.tracer = tracer or Tracer(trace_file)  # 每轮问答各阶段的耗时
+        if self.command_tts is not None:
+            self.tracer.add_collector(self.command_tts.prometheus_text)
+        self.metrics_port = metrics_port
+        self.turn = None
+        self.turn_received = 0  # 本轮开始时已入队的提问数，之后的才算打断
+        self.warm_task = None
+        self.encoding_task = None
+        self.answer_cache = answer_cache  # 可选的AnswerCache，重复的问题不再请求LLM
+        self.history_dir = history_dir  # 对话历史保存目录，重启后继续之前的对话
+        self.idle_timeout = idle_timeout  # 超过这么多秒没有对话就开始新话题
+        # 可选的多个OpenAI兼容后端，如[{"url": ..., "api_key": ..., "engine": ...}]，按顺序失败转移
+        self.llm_backends = llm_backends
+        self.llm_hedge_delay = llm_hedge_delay  # 首个token超过这么多秒未到时同时请求下一个后端
+        self.summary_target_tokens = summary_target_tokens  # 如800，较早的对话在后台压缩成摘要
+        self.router = router or IntentRouter.from_model_file(INTENT_MODEL)
 
     async def init_all_data(self, session):
+        self.preload_encoding()
         await self.login_miboy(session)
         await self._init_data_hardware()
-        with open(self.mi_token_home) as f:
-            user_data = json.loads(f.read())
-        self.user_id = user_data.get("userId")
-        self.service_token = user_data.get("micoapi")[1]
+        if self.status_watcher is None or self.status_watcher.device_id != self.device_id:
+            if self.status_watcher is not None:
+                await self.status_watcher.stop()
+            self.status_watcher = StatusWatcher(self.mina_service, self.device_id)
+        self.status_watcher.start()
         self._init_cookie()
         await self._init_first_data_and_chatbot()
+        self.warm_up()
 
     async def login_miboy(self, session):
         self.session = session
-        self.account = MiAccount(
-            session,
-            MI_USER,
-            MI_PASS,
-            str(self.mi_token_home),
-        )
-        # Forced login to refresh token
-        await self.account.login("micoapi")
-        self.mina_service = MiNAService(self.account)
+        if self.account is None:
+            self.account = MiAccount(
+                session,
+                self.mi_user,
+                self.mi_pass,
+                str(self.mi_token_home),
+            )
+        # 复用内存或磁盘中仍有效的token，只在缺失或快过期时登录
+        if not await self.account.ensure_token("micoapi"):
+            raise Exception(f"login {self.mi_user} failed")
+        if self.mina_service is None:
+            self.mina_service = MiNAService(self.account, self.tts_hedge_delay)
+        if self.device_registry is None:
+            self.device_registry = DeviceRegistry(
+                self.mina_service, get_devices_path(self.mi_user)
+            )
+        self._load_token()
+
+    def _load_token(self):
+        self.user_id = self.account.token.get("userId")
+        self.service_token = self.account.token.get("micoapi")[1]
 
     async def _init_data_hardware(self):
-        if self.cookie:
-            # cookie does not need init
+        if self.cookie or self.device_id:
+            # cookie or known device does not need init
             return
-        hardware_data = await self.mina_service.device_list()
-        for h in hardware_data:
-            if h.get("hardware", "") == self.hardware:
-                self.device_id = h.get("deviceID")
-                break
-        else:
-            raise Exception(f"we have no hardware: {self.hardware} please check")
+        # 优先使用缓存的设备列表，重启和重连都不需要再请求
+        device = await self.device_registry.find(self.hardware, self.device_name)
+        if device is None:
+            raise Exception(
+                f"we have no hardware: {self.hardware} {self.device_name or ''} please check"
+            )
+        self.device_id = device.get("deviceID")
 
     def _init_cookie(self):
         if self.cookie:
-            self.cookie = parse_cookie_string(self.cookie)
+            self.cookies = parse_cookie_string(self.cookie)
         else:
             self.cookie_string = COOKIE_TEMPLATE.format(
                 device_id=self.device_id,
                 service_token=self.service_token,
                 user_id=self.user_id,
             )
-            self.cookie = parse_cookie_string(self.cookie_string)
+            self.cookies = parse_cookie_string(self.cookie_string)
 
     async def _init_first_data_and_chatbot(self):
-        data = await self.get_latest_ask_from_xiaoai()
-        self.last_timestamp, self.last_record = self.get_last_timestamp_and_record(data)
-        self.chatbot = Chatbot(api_key=OPENAI_API_KEY)
-
-    async def get_latest_ask_from_xiaoai(self):
-        r = await self.session.get(
-            LATEST_ASK_API.format(
-                hardware=self.hardware, timestamp=str(int(time.time() * 1000))
-            ),
-            cookies=parse_cookie_string(self.cookie),
+        if self.query_poller is None:
+            self.query_poller = QueryPoller(self.session, self.hardware, self.cookies)
+            self.last_record = await self.query_poller.prime()
+        else:
+            self.query_poller.session = self.session
+            self.query_poller.cookies = self.cookies
+        if self.chatbot is not None:
+            # 重连时保留对话
+            return
+        self.chatbot = Chatbot(
+            api_key=self.api_key,
+            aio_session=self.session,
+            timeout=TIMEOUTS["llm"],
+            answer_cache=self.answer_cache,
+            journal=ConversationJournal(self.history_dir) if self.history_dir else None,
+            idle_timeout=self.idle_timeout,
+            backends=[Backend(**b) for b in self.llm_backends] if self.llm_backends else None,
+            hedge_delay=self.llm_hedge_delay,
+            summary_target_tokens=self.summary_target_tokens,
         )
-        return await r.json()
 
-    def get_last_timestamp_and_record(self, data):
-        if d := data.get("data"):
-            records = json.loads(d).get("records")
-            if not records:
-                return 0, None
-            last_record = records[0]
-            timestamp = last_record.get("time")
-            return timestamp, last_record
+    def _span(self, stage, **attrs):
+        if self.turn is None:
+            return contextlib.nullcontext()
+        return self.turn.span(stage, **attrs)
+
+    def _mark(self, stage, **attrs):
+        if self.turn is not None:
+            self.turn.mark(stage, **attrs)
 
     async def do_tts(self, value):
-        if not self.use_command:
+        with self._span("tts", chars=len(value)):
+            if not self.use_command:
+                try:
+                    await self.mina_service.text_to_speech(self.device_id, value)
+                except MiRequestError as e:
+                    # 已经按策略重试过，丢掉这一句继续
+                    _LOGGER.warning("TTS on %s failed: %s", self.hardware, e)
+            else:
+                await self.command_tts.speak(self.tts_command, value)
+
+    async def get_if_xiaoai_is_playing(self, max_age=None):
+        # 由后台的StatusWatcher轮询，max_age内的状态直接复用
+        return await self.status_watcher.get_is_playing(max_age=max_age)
+
+    def preload_encoding(self):
+        # 在线程中加载tokenizer，与小米登录同时进行
+        if self.encoding_task is None:
+            loop = asyncio.get_running_loop()
+            self.encoding_task = loop.run_in_executor(None, get_encoding, DEFAULT_ENGINE)
+            self.encoding_task.add_done_callback(self._on_encoding_loaded)
+
+    def _on_encoding_loaded(self, future):
+        if not future.cancelled() and future.exception() is not None:
+            _LOGGER.error("Load tokenizer failed: %s", future.exception())
+            self.encoding_task = None  # 下次init_all_data再试
+
+    def warm_up(self):
+        # 空闲时在后台准备好对话和到LLM的连接
+        if self.warm_task is None or self.warm_task.done():
+            self.warm_task = asyncio.create_task(self.chatbot.warm_up(self.device_id))
+            self.warm_task.add_done_callback(self._on_warmed_up)
+
+    def _on_warmed_up(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            _LOGGER.warning("Warm up %s failed: %s", self.hardware, task.exception())
+
+    async def pause_xiaoai(self):
+        # 不先查询状态，直接暂停，只需一次ubus请求
+        with self._span("stop"):
             try:
-                await self.mina_service.text_to_speech(self.device_id, value)
-            except:
-                # do nothing is ok
-                pass
-        else:
-            subprocess.check_output(["micli", self.tts_command, value])
-
-    async def get_if_xiaoai_is_playing(self):
-        playing_info = await self.mina_service.player_get_status(self.device_id)
-        # WTF xiaomi api
-        is_playing = (
-                json.loads(playing_info.get("data", {}).get("info", "{}")).get("status", -1)
-                == 1
-        )
-        return is_playing
+                await self.mina_service.player_pause(self.device_id)
+            except MiRequestError as e:
+                _LOGGER.warning("Pause %s failed: %s", self.hardware, e)
+
+    async def _speak_after_pause(self, pause_task, scheduler):
+        # 小爱停下之后再开始播报，避免暂停操作打断我们自己的TTS
+        await pause_task
+        await scheduler.run()
 
     async def stop_if_xiaoai_is_playing(self):
-        is_playing = await self.get_if_xiaoai_is_playing()
-        if is_playing:
-            # stop it
-            await self.mina_service.player_pause(self.device_id)
+        try:
+            is_playing = await self.get_if_xiaoai_is_playing(max_age=0)
+            if is_playing:
+                # stop it
+                await self.mina_service.player_pause(self.device_id)
+        except MiRequestError as e:
+            # 已经按策略重试过（或熔断中），不影响后面的提问
+            _LOGGER.warning("Stop %s failed: %s", self.hardware, e)
+
+    async def poll_queries(self, session):
+        try:
+            await self.query_poller.poll()
+        except QueryAuthError:
+            # token失效，刷新（与其他请求共用一次登录）后重建cookie
+            if not await self.account.refresh("micoapi", self.service_token):
+                raise
+            self._load_token()
+            self._init_cookie()
+            self.query_poller.cookies = self.cookies
+        except (QueryError, ClientError, asyncio.TimeoutError) as e:
+            # 网络抖动或错误的响应，下次轮询再试，不必重新登录
+            _LOGGER.warning("Poll %s failed: %s", self.hardware, e)
+
+    async def watch_queries(self, session):
+        # 唯一的提问轮询任务，新提问会唤醒主循环，或者打断正在进行的回答
+        while True:
+            await self.poll_queries(session)
+            if self.turn is not None:
+                # 回答期间保持快速轮询，及时发现打断
+                self.query_poller.boost()
+            await self.query_poller.wait()
+
+    async def watch_wakeups(self):
+        # 只在小爱从空闲变为播放时加速轮询，播放音乐等不会一直占用请求
+        changes = self.status_watcher.subscribe()
+        try:
+            while True:
+                if await changes.get() and self.turn is None:
+                    # 很可能刚被唤醒
+                    self.query_poller.boost()
+                    self.warm_up()
+        finally:
+            self.status_watcher.unsubscribe(changes)
 
-    async def check_new_query(self, session):
+    async def _stream_answer(self, query, scheduler):
+        segmenter = SentenceSegmenter(wait_times=self.wait_times)
+        first_content = first_sentence = True
         try:
-            r = await self.get_latest_ask_from_xiaoai()
-        except Exception:
-            # we try to init all again
-            await self.init_all_data(session)
-            r = await self.get_latest_ask_from_xiaoai()
-        new_timestamp, last_record = self.get_last_timestamp_and_record(r)
-        if new_timestamp > self.last_timestamp:
-            return new_timestamp, last_record.get("query", "")
-        return False, None
-
-    async def run_forever(self):
-        global SWITCH
+            async for content in self.chatbot.ask_stream_async(query, convo_id=self.device_id):
+                if first_content:
+                    first_content = False
+                    self._mark("llm_first_byte")
+                # 取出完整的句组，剩下的继续累积
+                if (this_sentence := segmenter.feed(content)) is not None:
+                    if first_sentence:
+                        first_sentence = False
+                        self._mark("first_sentence")
+                    scheduler.put(this_sentence)
+            # 流结束，剩余部分作为最后一句
+            if (this_sentence := segmenter.flush()) is not None:
+                scheduler.put(this_sentence)
+        except Exception as e:
+            print('\033[1;34m' + 'INFO: ' + '\033[0m', end='')
+            print('\033[1;31m' + f'ChatGPT请求失败: {e}' + '\033[0m')
+        finally:
+            scheduler.close()  # 回答结束（或出错）
+
+    async def speak_answer(self, query, session):
+        scheduler = TTSScheduler(self.do_tts, self.status_watcher, self.hardware)
+        self.status_watcher.set_active(True)
+        try:
+            # LLM流、分句和TTS队列作为一组任务，打断时一起取消
+            async with TaskGroup() as group:
+                # 先发出LLM请求，暂停小爱与之并行
+                group.create_task(self._stream_answer(query, scheduler))
+                pause_task = group.create_task(self.pause_xiaoai())
+                tts_task = group.create_task(self._speak_after_pause(pause_task, scheduler))
+                # 只有本轮开始之后的新提问才打断，同一次轮询到的更早提问排队依次回答
+                barge_in = group.create_task(
+                    self.query_poller.wait_new_query(after=self.turn_received)
+                )
+                await asyncio.wait([tts_task, barge_in], return_when=asyncio.FIRST_COMPLETED)
+                interrupted = not tts_task.done()
+                group.cancel()
+        finally:
+            self.status_watcher.set_active(False)
+        if not interrupted:
+            return
+        self._mark("barge_in")
+        await self.stop_if_xiaoai_is_playing()
+        await self.do_tts('')  # 空串施法打断
+        if not self.chatbot.has_printed:
+            print()
+        record = self.query_poller.queued_after(self.turn_received)[0]
+        if record.get("query", "").startswith('闭嘴'):
+            self.query_poller.pending.remove(record)
+            # 打印彩色信息
+            print('\033[1;34m' + 'INFO: ' + '\033[0m', end='')
+            print('\033[1;31m' + 'ChatGPT暂停回答' + '\033[0m')
+        else:
+            print('\033[1;34m' + 'INFO: ' + '\033[0m', end='')
+            print('\033[1;33m' + '有新的问答，ChatGPT停止当前回答' + '\033[0m')
+
+    async def run_forever(self, session=None):
         print("正在运行 MiGPT, 请用\"打开/关闭高级对话\"控制对话模式。")
-        async with ClientSession() as session:
-            await self.init_all_data(session)
+        if session is not None:
+            # 由Supervisor统一管理的共享会话
+            await self.run(session)
+            return
+        async with create_session(stats=self.pool_stats) as session:
+            await self.run(session)
+
+    async def run(self, session):
+        await self.init_all_data(session)
+        if self.metrics_port:
+            await self.tracer.serve(port=self.metrics_port)
+        async with TaskGroup() as group:
+            group.create_task(self.watch_queries(session))
+            group.create_task(self.watch_wakeups())
             while True:
+                await self.query_poller.wait_new_query()
+                # 按时间顺序处理每一条新的提问
+                record = self.query_poller.pending.popleft()
+                self.turn_received = self.query_poller.received
+                self.turn = self.tracer.start_turn(
+                    record.get("time"), device=self.hardware, query=record.get("query", "")
+                )
+                # 从小爱记录下提问到我们轮询到它的时间
+                self.turn.add_span("detect", record.get("time", 0) / 1000, self.turn.started)
                 try:
-                    r = await self.get_latest_ask_from_xiaoai()
-                except Exception:
-                    # we try to init all again
-                    await self.init_all_data(session)
-                    r = await self.get_latest_ask_from_xiaoai()
-                new_timestamp, last_record = self.get_last_timestamp_and_record(r)
-                if new_timestamp > self.last_timestamp:
-                    self.last_timestamp = new_timestamp
-                    query = last_record.get("query", "")
-                    if query.startswith('闭嘴') or query.startswith('停止'):  # 反悔操作
-                        await self.stop_if_xiaoai_is_playing()
-                        continue
-                    if query.startswith('打开高级对话') or query.startswith('开启高级对话'):
-                        SWITCH = True
-                        print("\033[1;32m高级对话已开启\033[0m")
-                        await self.do_tts("高级对话已开启")
-                        continue
-                    if query.startswith('关闭高级对话'):
-                        SWITCH = False
-                        print("\033[1;32m高级对话已关闭\033[0m")
-                        await self.do_tts("高级对话已关闭")
-                        continue
-                    if SWITCH:
-                        commas = 0
-                        wait_times = 3
-                        await self.stop_if_xiaoai_is_playing()
-                        query = f"{query}，{PROMPT}"
-                        try:
-                            print(
-                                "以下是小爱的回答: ",
-                                last_record.get("answers")[0]
-                                .get("tts", {})
-                                .get("text").strip(),
-                            )
-                        except:
-                            print("小爱没回")
-                        print("以下是GPT的回答:  ", end="")
-                        lock = threading.Lock()
-                        stop_event = threading.Event()
-                        thread = threading.Thread(target=self.chatbot.ask_stream, args=(query, lock, stop_event))
-                        thread.start()
-                        while 1:
-                            success = lock.acquire(blocking=False)
-                            if success:  # 如果成功获取锁
-                                try:
-                                    this_sentence = self.chatbot.sentence  # 获取句子（目前的）
-                                    if this_sentence == "" and not thread.is_alive():
-                                        break
-                                    is_a_sentence = False
-                                    for x in (("，", "。", "？", "！", "；", ",", ".", "?", "!", ";")
-                                    if commas <= wait_times else ("。", "？", "！", "；", ".", "?", "!", ";")):
-                                        pos = this_sentence.rfind(x)
-                                        if pos != -1:
-                                            is_a_sentence = True
-                                            # 取出完整的句组，剩下的放回去
-                                            self.chatbot.sentence = this_sentence[pos + 1:]
-                                            this_sentence = this_sentence[:pos + 1]
-                                            break
-                                finally:
-                                    lock.release()
-                            else:
-                                time.sleep(0.01)
-                                continue
-                            if not is_a_sentence:
-                                time.sleep(0.01)
-                                continue
-                            if not await self.get_if_xiaoai_is_playing():
-                                if commas <= wait_times:
-                                    commas += sum([1 for x in this_sentence if
-                                                   x in {"，", "。", "？", "！", "；", ",", ".", "?", "!", ";"}]) + 1
-                                await self.do_tts(this_sentence)
-                                while await self.get_if_xiaoai_is_playing() and not \
-                                        (await self.check_new_query(session))[0]:
-                                    await asyncio.sleep(0.1)
-                                time_stamp, query = await self.check_new_query(session)
-                                if time_stamp:
-                                    stop_event.set()
-                                    while True:
-                                        success = lock.acquire(blocking=False)
-                                        if success:
-                                            try:
-                                                self.chatbot.sentence = ""
-                                            finally:
-                                                lock.release()
-                                            break
-                                    await self.stop_if_xiaoai_is_playing()
-                                    await self.do_tts('')  # 空串施法打断
-                                    if not self.chatbot.has_printed:
-                                        print()
-                                    if query.startswith('闭嘴'):
-                                        self.last_timestamp = time_stamp
-                                        # 打印彩色信息
-                                        print('\033[1;34m' + 'INFO: ' + '\033[0m', end='')
-                                        print('\033[1;31m' + 'ChatGPT暂停回答' + '\033[0m')
-                                    else:
-                                        print('\033[1;34m' + 'INFO: ' + '\033[0m', end='')
-                                        print('\033[1;33m' + '有新的问答，ChatGPT停止当前回答' + '\033[0m')
-                                    break
+                    await self.handle_record(record, session)
+                finally:
+                    self.tracer.finish_turn(self.turn)
+                    self.turn = None
 
+    async def handle_command(self, command):
+        if command == "stop":  # 反悔操作
+            await self.stop_if_xiaoai_is_playing()
+        elif command == "enable_llm":
+            self.switch = True
+            print("\033[1;32m高级对话已开启\033[0m")
+            await self.do_tts("高级对话已开启")
+        elif command == "disable_llm":
+            self.switch = False
+            print("\033[1;32m高级对话已关闭\033[0m")
+            await self.do_tts("高级对话已关闭")
+
+    async def handle_record(self, last_record, session):
+        query = last_record.get("query", "")
+        with self._span("route"):
+            route = self.router.route(query)
+        if route.intent == INTENT_COMMAND:
+            await self.handle_command(route.command)
+            return
+        if route.intent == INTENT_NATIVE:
+            # 开关灯、天气等交给小爱自己回答，不请求GPT也不打断
+            _LOGGER.debug("Leave %r to xiaoai, score %.2f", query, route.score)
+            return
+        if self.switch:
+            query = f"{query}，{PROMPT}"
+            try:
+                print(
+                    "以下是小爱的回答: ",
+                    last_record.get("answers")[0]
+                    .get("tts", {})
+                    .get("text").strip(),
+                )
+            except:
+                print("小爱没回")
+            print("以下是GPT的回答:  ", end="")
+            await self.speak_answer(query, session)
 
 if __name__ == "__main__":
+    check_config()
     miboy = MiGPT()
     asyncio.run(miboy.run_forever())
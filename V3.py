@@ -1,9 +1,54 @@
 """
 A simple wrapper for the official ChatGPT API
 """
+import asyncio
+import functools
 import json
-import requests
-import tiktoken
+import logging
+import os
+import sys
+import threading
+import time
+import aiohttp
+from answercache import AnswerCache
+from conversation import Conversation, ConversationManager
+from journal import ConversationJournal
+from llmpool import Backend, BackendPool
+from sseparser import DeltaBuffer, iter_deltas
+
+API_URL = "https://api.openai.com/v1/chat/completions"
+DEFAULT_ENGINE = "gpt-3.5-turbo"
+SUMMARY_PREFIX = "以下是之前对话的摘要："
+SUMMARY_PROMPT = (
+    "把下面的对话（可能以之前的摘要开头）压缩成一段简短的摘要，"
+    "保留用户的偏好、提到的事实和未完成的话题，不要评论，直接输出摘要。"
+)
+
+_LOGGER = logging.getLogger(__package__)
+
+_encoding_lock = threading.Lock()
+
+
+@functools.lru_cache()
+def _load_encoding(engine: str):
+    # tiktoken默认缓存在临时目录，重启后可能被清空，改为持久的缓存目录，断网也能启动
+    os.environ.setdefault(
+        "TIKTOKEN_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "tiktoken")
+    )
+    import tiktoken
+
+    return tiktoken.encoding_for_model(engine)
+
+
+def get_encoding(engine: str):
+    """
+    Get the (cached) tiktoken encoding for an engine. Thread safe, so it can
+    be preloaded in an executor while the event loop does other work.
+    """
+    if engine not in ["gpt-3.5-turbo", "gpt-3.5-turbo-0301"]:
+        raise NotImplementedError(f"Unsupported engine {engine}")
+    with _encoding_lock:
+        return _load_encoding(engine)
 
 
 class Chatbot:
@@ -14,7 +59,7 @@ class Chatbot:
     def __init__(
             self,
             api_key: str,
-            engine: str = "gpt-3.5-turbo",
+            engine: str = DEFAULT_ENGINE,
             proxy: str = None,
             max_tokens: int = 3000,
             temperature: float = 0.5,
@@ -23,14 +68,37 @@ class Chatbot:
             frequency_penalty: float = 0.0,
             reply_count: int = 1,
             system_prompt: str = "You are ChatGPT, a large language model trained by OpenAI. Respond conversationally",
+            aio_session: aiohttp.ClientSession = None,
+            timeout: aiohttp.ClientTimeout = None,
+            answer_cache: AnswerCache = None,
+            journal: ConversationJournal = None,
+            idle_timeout: float = None,
+            max_conversations: int = 64,
+            max_conversation_chars: int = 500_000,
+            backends: list = None,
+            hedge_delay: float = None,
+            summary_target_tokens: int = None,
     ) -> None:
         """
         Initialize Chatbot with API key (from https://platform.openai.com/account/api-keys)
         """
         self.engine = engine
-        self.session = requests.Session()
+        self._session = None  # 同步接口使用的requests会话，首次使用时创建
+        # 异步流式接口使用的会话，未传入时在首次请求时创建
+        self.aio_session = aio_session
+        self._owns_aio_session = False
+        self._used_at = 0.0  # 上次请求API的时间，用于判断连接是否还在keep-alive
+        self.timeout = timeout
+        self.answer_cache = answer_cache
+        self.journal = journal
         self.api_key = api_key
         self.proxy = proxy
+        # 默认只有一个后端，即API_URL和上面的api_key/engine/proxy
+        self.backends = BackendPool(backends or [Backend()], hedge_delay=hedge_delay)
+        # 设置后，超过这个token数的对话在两轮之间把较早的内容压缩成摘要，否则只按max_tokens截断
+        self.summary_target_tokens = summary_target_tokens
+        self._summary_tasks = {}
+        self._encoding_loaded = False
 
         self.system_prompt = system_prompt
         self.max_tokens = max_tokens
@@ -44,25 +112,55 @@ class Chatbot:
         self.temp = ""
         self.has_printed = False
 
-        if self.proxy:
-            proxies = {
-                "http": self.proxy,
-                "https": self.proxy,
-            }
-            self.session.proxies = proxies
-        self.conversation: dict = {
-            "default": [
-                {
-                    "role": "system",
-                    "content": system_prompt,
-                },
-            ],
-        }
+        # 超过idle_timeout没有交互的对话重新开始，淘汰的对话可以从journal恢复
+        self.conversation = ConversationManager(
+            idle_timeout=idle_timeout,
+            max_conversations=max_conversations,
+            max_chars=max_conversation_chars,
+        )
         if max_tokens > 4000:
             raise Exception("Max tokens cannot be greater than 4000")
+        # 对话（以及tokenizer）在第一次使用时才加载，见warm_up
 
-        if self.get_token_count("default") > self.max_tokens:
-            raise Exception("System prompt is too long")
+    @property
+    def session(self):
+        """
+        requests session of the synchronous ask_stream, created on first use
+        """
+        if self._session is None:
+            import requests
+
+            self._session = requests.Session()
+            if self.proxy:
+                self._session.proxies = {
+                    "http": self.proxy,
+                    "https": self.proxy,
+                }
+        return self._session
+
+    def get_conversation(self, convo_id: str = "default") -> Conversation:
+        """
+        Get a live conversation, loading it from the journal or starting a new one
+        """
+        known = convo_id in self.conversation
+        conversation = self.conversation.get(convo_id)
+        if conversation is None:
+            messages = None
+            # 内存中的对话已过期时不再从journal恢复
+            if self.journal is not None and not known:
+                mtime = self.journal.mtime(convo_id)
+                if mtime is not None and not self.conversation.is_expired(mtime):
+                    messages = self.journal.load(convo_id)
+            if messages:
+                conversation = Conversation()
+                for role, content in messages:
+                    conversation.append(role, content, self.__count_message_tokens(role, content))
+                conversation.last_active = mtime
+                self.conversation[convo_id] = conversation
+            else:
+                self.reset(convo_id=convo_id, system_prompt=self.system_prompt)
+                conversation = self.conversation[convo_id]
+        return conversation
 
     def add_to_conversation(
             self,
@@ -73,42 +171,38 @@ class Chatbot:
         """
         Add a message to the conversation
         """
-        self.conversation[convo_id].append({"role": role, "content": message})
+        conversation = self.get_conversation(convo_id)
+        conversation.append(role, message, self.__count_message_tokens(role, message))
+        self.conversation.touch(convo_id)
+        if self.journal is not None:
+            self.journal.append(convo_id, role, message)
+        self.conversation.enforce_limits()
 
     def __truncate_conversation(self, convo_id: str = "default") -> None:
         """
         Truncate the conversation
         """
-        while True:
-            if (
-                    self.get_token_count(convo_id) > self.max_tokens
-                    and len(self.conversation[convo_id]) > 1
-            ):
-                # Don't remove the first message
-                self.conversation[convo_id].pop(1)
-            else:
-                break
+        conversation = self.get_conversation(convo_id)
+        # Don't remove the first message
+        while conversation.total + 2 > self.max_tokens and len(conversation) > 1:
+            conversation.pop(1)
+            if self.journal is not None:
+                self.journal.pop(convo_id, 1)
 
     # https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_tokens_with_tiktoken.ipynb
+    def __count_message_tokens(self, role: str, content: str) -> int:
+        """
+        Count the tokens of a single message
+        """
+        encoding = get_encoding(self.engine)
+        # every message follows <im_start>{role/name}\n{content}<im_end>\n
+        return 4 + len(encoding.encode(role)) + len(encoding.encode(content))
+
     def get_token_count(self, convo_id: str = "default") -> int:
         """
         Get token count
         """
-        if self.engine not in ["gpt-3.5-turbo", "gpt-3.5-turbo-0301"]:
-            raise NotImplementedError("Unsupported engine {self.engine}")
-
-        encoding = tiktoken.encoding_for_model(self.engine)
-
-        num_tokens = 0
-        for message in self.conversation[convo_id]:
-            # every message follows <im_start>{role/name}\n{content}<im_end>\n
-            num_tokens += 4
-            for key, value in message.items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":  # if there's a name, the role is omitted
-                    num_tokens += -1  # role is always required and always 1 token
-        num_tokens += 2  # every reply is primed with <im_start>assistant
-        return num_tokens
+        return self.get_conversation(convo_id).total + 2  # every reply is primed with <im_start>assistant
 
     def get_max_tokens(self, convo_id: str) -> int:
         """
@@ -116,6 +210,235 @@ class Chatbot:
         """
         return self.max_tokens - self.get_token_count(convo_id)
 
+    def __prepare_conversation(self, prompt: str, convo_id: str) -> None:
+        """
+        Add the prompt to the (possibly journaled) conversation and truncate it
+        """
+        self.add_to_conversation(prompt, "user", convo_id=convo_id)
+        self.__truncate_conversation(convo_id=convo_id)
+
+    def __finish_answer(self, convo_id: str) -> None:
+        """
+        Compact the journal and maybe start a summary, after the answer so
+        neither delays the request
+        """
+        if self.journal is not None:
+            self.journal.maybe_compact(convo_id, self.conversation[convo_id].messages)
+        self.__schedule_summary(convo_id)
+
+    def __last_answer(self, convo_id: str) -> str:
+        """
+        Content of the last assistant message before the current prompt
+        """
+        for role, content, _ in reversed(self.conversation[convo_id].messages[:-1]):
+            if role == "assistant":
+                return content
+        return ""
+
+    def __build_payload(self, role: str, convo_id: str) -> dict:
+        """
+        Build the request body for a streaming completion
+        """
+        return {
+            "model": self.engine,
+            "messages": self.conversation[convo_id].to_dicts(),
+            "stream": True,
+            "temperature": self.temperature,
+            "top_p": self.top_p,
+            "presence_penalty": self.presence_penalty,
+            "frequency_penalty": self.frequency_penalty,
+            "n": self.reply_count,
+            "user": role,
+            "max_tokens": self.get_max_tokens(convo_id=convo_id),
+        }
+
+    async def ask_stream_async(
+            self,
+            prompt: str,
+            role: str = "user",
+            convo_id: str = "default",
+    ):
+        """
+        Ask a question, yielding content deltas as they arrive.
+        Cancel the consuming task to stop the answer.
+        """
+        self.has_printed = False
+        # 计数前先确保tokenizer已加载，不在事件循环里等待加载或下载
+        await self.load_encoding()
+        self.__prepare_conversation(prompt, convo_id)
+        cache_key = None
+        cache_ttl = self.answer_cache.ttl_for(prompt) if self.answer_cache is not None else 0
+        if cache_ttl:
+            # 上一轮的回答也算上下文，"为什么"之类的追问不会命中别的对话的答案
+            cache_key = self.answer_cache.make_key(
+                prompt, self.engine, self.system_prompt, self.__last_answer(convo_id)
+            )
+            answer = self.answer_cache.get(cache_key)
+            if answer is not None:
+                # 命中缓存，逐字回放，走和流式回答相同的分句/TTS流程
+                print(answer)
+                for content in answer:
+                    yield content
+                self.has_printed = True
+                self.add_to_conversation(answer, "assistant", convo_id=convo_id)
+                self.__finish_answer(convo_id)
+                return
+        self._used_at = time.monotonic()
+        payload = self.__build_payload(role, convo_id)
+        response_role: str = None
+        full_response = DeltaBuffer()
+        write = sys.stdout.write
+        async for delta in self.backends.stream(lambda backend: self.__post(backend, payload)):
+            if "role" in delta:
+                response_role = delta["role"]
+            if "content" in delta:
+                content = delta["content"]
+                write(content)
+                full_response.append(content)
+                yield content
+        print()
+        self.has_printed = True
+        full_response = full_response.getvalue()
+        self.add_to_conversation(full_response, response_role, convo_id=convo_id)
+        if cache_key is not None and full_response:
+            self.answer_cache.put(cache_key, full_response, cache_ttl)
+        self.__finish_answer(convo_id)
+
+    def __schedule_summary(self, convo_id: str) -> None:
+        """
+        Start summarizing the conversation in the background if it grew past the target
+        """
+        if (
+            self.summary_target_tokens is None
+            or self.get_conversation(convo_id).total <= self.summary_target_tokens
+        ):
+            return
+        task = self._summary_tasks.get(convo_id)
+        if task is not None and not task.done():
+            return
+        task = asyncio.ensure_future(self.__summarize(convo_id))
+        self._summary_tasks[convo_id] = task
+
+        def done(task):
+            if self._summary_tasks.get(convo_id) is task:
+                del self._summary_tasks[convo_id]
+            if not task.cancelled() and task.exception() is not None:
+                _LOGGER.warning("Summarize %s failed: %s", convo_id, task.exception())
+
+        task.add_done_callback(done)
+
+    async def __summarize(self, convo_id: str) -> None:
+        """
+        Fold everything but the latest messages into one summary message
+        """
+        conversation = self.get_conversation(convo_id)
+        messages = conversation.messages
+        # 最近的消息保留原文，至少一问一答，总共不超过目标的一半
+        keep = tokens = 0
+        for message in reversed(messages[1:]):
+            if keep >= 2 and tokens + message[2] > self.summary_target_tokens // 2:
+                break
+            keep += 1
+            tokens += message[2]
+        cut = len(messages) - keep
+        old = messages[1:cut]
+        if not old or (len(old) == 1 and old[0][1].startswith(SUMMARY_PREFIX)):
+            return
+        transcript = "\n".join(f"{role}: {content}" for role, content, _ in old)
+        payload = {
+            "model": self.engine,
+            "messages": [
+                {"role": "system", "content": SUMMARY_PROMPT},
+                {"role": "user", "content": transcript},
+            ],
+            "stream": True,
+            "temperature": 0.3,
+            "max_tokens": self.summary_target_tokens // 2,
+        }
+        summary = DeltaBuffer()
+        async for delta in self.backends.stream(lambda backend: self.__post(backend, payload)):
+            if "content" in delta:
+                summary.append(delta["content"])
+        summary = summary.getvalue().strip()
+        # 摘要期间对话可能被截断、重置或淘汰，这时放弃这次摘要
+        if (
+            not summary
+            or convo_id not in self.conversation
+            or self.conversation[convo_id] is not conversation
+            or conversation.messages[1:cut] != old
+        ):
+            return
+        content = SUMMARY_PREFIX + summary
+        conversation.splice(1, cut, [("system", content, self.__count_message_tokens("system", content))])
+        if self.journal is not None:
+            self.journal.replace(convo_id, conversation.messages)
+
+    def __post(self, backend: Backend, payload: dict):
+        """
+        Start a streaming completion request on one backend
+        """
+        if backend.engine:
+            payload = dict(payload, model=backend.engine)
+        return self.__get_aio_session().post(
+            backend.url or API_URL,
+            headers={"Authorization": f"Bearer {backend.api_key or self.api_key}"},
+            json=payload,
+            proxy=backend.proxy or self.proxy,
+            timeout=self.timeout,
+        )
+
+    def __get_aio_session(self) -> aiohttp.ClientSession:
+        if self.aio_session is None or self.aio_session.closed:
+            self.aio_session = aiohttp.ClientSession()
+            self._owns_aio_session = True
+        return self.aio_session
+
+    async def warm_up(self, convo_id: str = "default", max_idle: float = 30) -> None:
+        """
+        Prepare for the next question while idle: load the tokenizer and the
+        conversation, and open a keep-alive connection to the API unless one
+        was used within max_idle seconds
+        """
+        await self.load_encoding()
+        self.get_conversation(convo_id)
+        if time.monotonic() - self._used_at < max_idle:
+            return
+        self._used_at = time.monotonic()
+        await asyncio.gather(*(self.__head(b) for b in self.backends.candidates()))
+
+    async def load_encoding(self) -> None:
+        """
+        Load the tokenizer in a thread; counting tokens on the event loop
+        afterwards never waits for it
+        """
+        if not self._encoding_loaded:
+            await asyncio.get_running_loop().run_in_executor(None, get_encoding, self.engine)
+            self._encoding_loaded = True
+
+    async def __head(self, backend: Backend) -> None:
+        try:
+            # 不计费的HEAD请求，只为完成DNS、TCP和TLS握手
+            async with self.__get_aio_session().head(
+                backend.url or API_URL,
+                proxy=backend.proxy or self.proxy,
+                timeout=aiohttp.ClientTimeout(total=10),
+            ) as response:
+                await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            # 预热失败不影响正式请求
+            self._used_at = 0.0
+
+    async def close(self) -> None:
+        """
+        Close the aiohttp session if it was created by the chatbot
+        """
+        for task in list(self._summary_tasks.values()):
+            task.cancel()
+        if self._owns_aio_session and self.aio_session is not None:
+            await self.aio_session.close()
+        self.aio_session = None
+        self._owns_aio_session = False
+
     def ask_stream(
             self,
             prompt: str,
@@ -128,29 +451,12 @@ class Chatbot:
         Ask a question
         """
         self.has_printed = False
-        # Make conversation if it doesn't exist
-        if convo_id not in self.conversation:
-            self.reset(convo_id=convo_id, system_prompt=self.system_prompt)
-        self.add_to_conversation(prompt, "user", convo_id=convo_id)
-        self.__truncate_conversation(convo_id=convo_id)
+        self.__prepare_conversation(prompt, convo_id)
         # Get response
         response = self.session.post(
-            "https://api.openai.com/v1/chat/completions",
+            API_URL,
             headers={"Authorization": f"Bearer {self.api_key}"},
-            json={
-                "model": self.engine,
-                "messages": self.conversation[convo_id],
-                "stream": True,
-                "temperature": self.temperature,
-                "top_p": self.top_p,
-                "presence_penalty":
-                    self.presence_penalty,
-                "frequency_penalty":
-                    self.frequency_penalty,
-                "n": self.reply_count,
-                "user": role,
-                "max_tokens": self.get_max_tokens(convo_id=convo_id),
-            },
+            json=self.__build_payload(role, convo_id),
             stream=True,
         )
         if response.status_code != 200:
@@ -158,25 +464,12 @@ class Chatbot:
                 f"Error: {response.status_code} {response.reason} {response.text}",
             )
         response_role: str = None
-        full_response: str = ""
+        full_response = DeltaBuffer()
 
-        for line in response.iter_lines():
+        for delta in iter_deltas(response.iter_content(chunk_size=None)):
             if stop_event.is_set():
                 self.temp = ""
                 return
-            if not line:
-                continue
-            # Remove "data: "
-            line = line.decode("utf-8")[6:]
-            if line == "[DONE]":
-                break
-            resp: dict = json.loads(line)
-            choices = resp.get("choices")
-            if not choices:
-                continue
-            delta = choices[0].get("delta")
-            if not delta:
-                continue
             if "role" in delta:
                 response_role = delta["role"]
             if "content" in delta:
@@ -190,26 +483,36 @@ class Chatbot:
                         lock.release()
                 else:
                     self.temp += content
-                print(content, end="")
-                full_response += content
+                sys.stdout.write(content)
+                full_response.append(content)
         print()
         self.has_printed = True
-        self.add_to_conversation(full_response, response_role, convo_id=convo_id)
+        self.add_to_conversation(full_response.getvalue(), response_role, convo_id=convo_id)
+        if self.journal is not None:
+            self.journal.maybe_compact(convo_id, self.conversation[convo_id].messages)
 
     def rollback(self, n: int = 1, convo_id: str = "default") -> None:
         """
         Rollback the conversation
         """
+        conversation = self.get_conversation(convo_id)
         for _ in range(n):
-            self.conversation[convo_id].pop()
+            conversation.pop()
+            if self.journal is not None:
+                self.journal.pop(convo_id)
 
     def reset(self, convo_id: str = "default", system_prompt: str = None) -> None:
         """
         Reset the conversation
         """
-        self.conversation[convo_id] = [
-            {"role": "system", "content": system_prompt or self.system_prompt},
-        ]
+        conversation = Conversation()
+        content = system_prompt or self.system_prompt
+        conversation.append("system", content, self.__count_message_tokens("system", content))
+        if conversation.total + 2 > self.max_tokens:
+            raise Exception("System prompt is too long")
+        self.conversation[convo_id] = conversation
+        if self.journal is not None:
+            self.journal.replace(convo_id, conversation.messages)
 
     def save(self, file: str, *convo_ids: str) -> bool:
         """
@@ -217,10 +520,11 @@ class Chatbot:
         """
         try:
             with open(file, "w", encoding="utf-8") as f:
-                if convo_ids:
-                    json.dump({k: self.conversation[k] for k in convo_ids}, f, indent=2)
-                else:
-                    json.dump(self.conversation, f, indent=2)
+                json.dump(
+                    {k: self.conversation[k].to_dicts() for k in convo_ids or self.conversation},
+                    f,
+                    indent=2,
+                )
         except (FileNotFoundError, KeyError):
             return False
         return True
@@ -232,11 +536,16 @@ class Chatbot:
         """
         try:
             with open(file, encoding="utf-8") as f:
-                if convo_ids:
-                    convos = json.load(f)
-                    self.conversation.update({k: convos[k] for k in convo_ids})
-                else:
-                    self.conversation = json.load(f)
+                convos = json.load(f)
+                for k in convo_ids or convos:
+                    conversation = Conversation()
+                    for message in convos[k]:
+                        role, content = message["role"], message["content"]
+                        conversation.append(role, content, self.__count_message_tokens(role, content))
+                    self.conversation[k] = conversation
+                    if self.journal is not None:
+                        self.journal.replace(k, conversation.messages)
+                self.conversation.enforce_limits()
         except (FileNotFoundError, KeyError, json.decoder.JSONDecodeError):
             return False
         return True
@@ -273,11 +582,11 @@ class Chatbot:
 
                     if config.get("proxy") is not None:
                         self.proxy = config.get("proxy") or self.proxy
-                        proxies = {
-                            "http": self.proxy,
-                            "https": self.proxy,
-                        }
-                        self.session.proxies = proxies
+                        if self._session is not None:
+                            self._session.proxies = {
+                                "http": self.proxy,
+                                "https": self.proxy,
+                            }
         except (FileNotFoundError, KeyError, json.decoder.JSONDecodeError):
             return False
         return True
@@ -0,0 +1,98 @@
+import collections
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+
+_LOGGER = logging.getLogger(__package__)
+
+# 归一化时去掉空白和标点，"今天星期几？"和"今天星期几"算同一个问题
+_IGNORED = re.compile(r"[\s，。？！；、,.?!;:：\"'“”‘’]+")
+# 答案随时间变化的问题不缓存，比如"今天星期几"过了午夜就错了
+TIME_SENSITIVE_WORDS = (
+    "今天", "明天", "昨天", "后天", "前天", "现在", "几点", "几号", "星期", "礼拜",
+    "周几", "日期", "时间", "天气", "气温", "最新", "新闻", "今年", "本周", "这周",
+)
+
+
+def normalize(query):
+    """
+    Drop whitespace and punctuation and lowercase, shared with the intent router
+    """
+    return _IGNORED.sub("", query).lower()
+
+
+class AnswerCache:
+    """
+    LRU cache of complete answers with a per-entry TTL, optionally persisted
+    to a JSON file. Questions whose answer depends on the date or time are
+    not cached.
+    """
+
+    def __init__(self, path=None, ttl=3600, max_entries=256):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()  # key -> [expires_at, answer]
+        self.hits = 0
+        self.misses = 0
+        self.load()
+
+    normalize = staticmethod(normalize)
+
+    def ttl_for(self, query):
+        """
+        Seconds an answer to query may be reused, 0 if it should not be cached
+        """
+        if any(word in query for word in TIME_SENSITIVE_WORDS):
+            return 0
+        return self.ttl
+
+    def make_key(self, query, *context):
+        raw = "\n".join([self.normalize(query), *map(str, context)])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] < time.time():
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, answer, ttl=None):
+        self.entries[key] = [time.time() + (self.ttl if ttl is None else ttl), answer]
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        self.save()
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            _LOGGER.exception("Exception on load answer cache from %s", self.path)
+            return
+        now = time.time()
+        self.entries = collections.OrderedDict(
+            (k, v) for k, v in entries if v[0] >= now
+        )
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(list(self.entries.items()), f, ensure_ascii=False)
+            os.replace(tmp, self.path)
+        except OSError:
+            _LOGGER.exception("Exception on save answer cache to %s", self.path)
@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""
+End-to-end latency benchmark for MiGPT against local stand-in servers.
+
+    python benchmarks/bench_e2e.py [--turns 5] [--first-token-delay 0.4]
+
+Starts benchmarks/fakeservers.py in a subprocess, points MiGPT at it and
+asks --turns questions. For every turn it reports time to first TTS,
+gaps between sentences (negative: the next sentence cut the previous one),
+requests per endpoint and the CPU used by the MiGPT process.
+"""
+import argparse
+import asyncio
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import miaccount  # noqa: E402
+import minaservice  # noqa: E402
+import querypoller  # noqa: E402
+import V3  # noqa: E402
+from httppool import create_session  # noqa: E402
+from MIGPT import MiGPT  # noqa: E402
+
+FAKESERVERS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fakeservers.py")
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def point_at(base):
+    miaccount.ACCOUNT_URL = base + "/pass/"
+    minaservice.MINA_URL = base
+    querypoller.LATEST_ASK_API = (
+        base + "/device_profile/v2/conversation?source=dialogu"
+        "&hardware={hardware}&timestamp={timestamp}&limit={limit}"
+    )
+    V3.API_URL = base + "/v1/chat/completions"
+
+
+async def wait_for_server(session, base, timeout=10):
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(base + "/_bench/stats") as r:
+                return await r.json()
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run_turn(session, base, query, settle, timeout):
+    async with session.post(base + "/_bench/reset"):
+        pass
+    cpu = cpu_seconds()
+    async with session.post(base + "/_bench/ask", json={"query": query}):
+        pass
+    deadline = time.monotonic() + timeout
+    while True:
+        await asyncio.sleep(0.2)
+        async with session.get(base + "/_bench/stats") as r:
+            stats = await r.json()
+        kinds = [e["kind"] for e in stats["events"]]
+        tts = [e for e in stats["events"] if e["kind"] == "tts"]
+        done = "llm_done" in kinds and tts and stats["now"] > tts[-1]["end"] + settle
+        if done or time.monotonic() > deadline:
+            break
+    cpu = cpu_seconds() - cpu
+    ask = next(e for e in stats["events"] if e["kind"] == "ask")
+    return {
+        "ttft": tts[0]["start"] - ask["t"] if tts else None,
+        "gaps": [b["start"] - a["end"] for a, b in zip(tts, tts[1:])],
+        "sentences": len(tts),
+        "counts": stats["counts"],
+        "cpu": cpu,
+        "timed_out": not done,
+    }
+
+
+def report(results):
+    ttfts = [r["ttft"] for r in results if r["ttft"] is not None]
+    gaps = [g for r in results for g in r["gaps"]]
+    print(f"turns: {len(results)}  timed out: {sum(r['timed_out'] for r in results)}")
+    if ttfts:
+        print(f"time to first TTS: median {statistics.median(ttfts):.3f}s  "
+              f"max {max(ttfts):.3f}s")
+    if gaps:
+        print(f"inter-sentence gap: median {statistics.median(gaps):.3f}s  "
+              f"max {max(gaps):.3f}s  cut {sum(g < 0 for g in gaps)}/{len(gaps)}")
+    endpoints = sorted({k for r in results for k in r["counts"]})
+    print("requests per turn:")
+    for endpoint in endpoints:
+        values = [r["counts"].get(endpoint, 0) for r in results]
+        print(f"  {endpoint:>24}: {statistics.mean(values):.1f}")
+    print(f"CPU per turn: {statistics.mean(r['cpu'] for r in results):.3f}s")
+
+
+async def main(args):
+    base = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([
+        sys.executable, FAKESERVERS,
+        "--port", str(args.port),
+        "--first-token-delay", str(args.first_token_delay),
+        "--tokens-per-second", str(args.tokens_per_second),
+        "--chars-per-second", str(args.chars_per_second),
+    ])
+    home = tempfile.mkdtemp(prefix="migpt-bench-")
+    os.environ["HOME"] = home  # token文件写到临时目录
+    point_at(base)
+    try:
+        async with create_session() as session:
+            await wait_for_server(session, base)
+            miboy = MiGPT(hardware="LX06", mi_user="bench", mi_pass="bench", api_key="bench")
+            task = asyncio.create_task(miboy.run_forever(session))
+            start = time.monotonic()
+            while miboy.query_poller is None or miboy.chatbot is None:
+                if task.done():
+                    task.result()
+                await asyncio.sleep(0.05)
+            print(f"startup: {time.monotonic() - start:.3f}s")
+            results = []
+            for i in range(args.turns):
+                results.append(await run_turn(
+                    session, base, f"第{i + 1}个问题", args.settle, args.timeout,
+                ))
+            task.cancel()
+            report(results)
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--first-token-delay", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=30.0)
+    parser.add_argument("--chars-per-second", type=float, default=5.0)
+    parser.add_argument("--settle", type=float, default=1.5)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    asyncio.run(main(parser.parse_args()))
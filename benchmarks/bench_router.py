@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: IntentRouter latency per query.
+
+    python benchmarks/bench_router.py [intent-model.json] [rounds]
+
+Without a model file a small one is trained on the built-in samples.
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from router import INTENT_LLM, INTENT_NATIVE, IntentModel, IntentRouter  # noqa: E402
+
+SAMPLES = [
+    ("打开客厅的灯", INTENT_NATIVE), ("关闭空调", INTENT_NATIVE),
+    ("今天天气怎么样", INTENT_NATIVE), ("定一个七点的闹钟", INTENT_NATIVE),
+    ("播放周杰伦的歌", INTENT_NATIVE), ("音量调大一点", INTENT_NATIVE),
+    ("为什么天空是蓝色的", INTENT_LLM), ("给我讲一个关于龙的故事", INTENT_LLM),
+    ("怎么学好英语", INTENT_LLM), ("写一首关于春天的诗", INTENT_LLM),
+    ("如何做红烧肉", INTENT_LLM), ("黑洞是怎么形成的", INTENT_LLM),
+]
+QUERIES = ["闭嘴", "打开卧室的灯", "明天会下雨吗", "给我讲一个很长很长的关于龙和骑士的故事吧"]
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else None
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 20000
+    model = IntentModel.load(path) if path else IntentModel.fit(SAMPLES)
+    router = IntentRouter(classifier=model)
+    for query in QUERIES:
+        seconds = timeit.timeit(lambda: router.route(query), number=rounds)
+        print(f"{seconds / rounds * 1e6:7.1f} us  {router.route(query)}  {query}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: SentenceSegmenter vs the old rfind-based segmentation.
+
+    python benchmarks/bench_segmenter.py [answer_chars] [rounds]
+"""
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from segmenter import SentenceSegmenter  # noqa: E402
+
+ALL_MARKS = ("，", "。", "？", "！", "；", ",", ".", "?", "!", ";")
+HARD_MARKS = ("。", "？", "！", "；", ".", "?", "!", ";")
+
+
+def make_deltas(chars):
+    text = "今天天气很好，适合出去走走。你可以去公园散步，也可以去湖边钓鱼！记得带上水；"
+    text = (text * (chars // len(text) + 1))[:chars]
+    # 模拟流式输出，每个delta 1~3个字
+    return [text[i:i + 2] for i in range(0, len(text), 2)]
+
+
+def old_segment(deltas, wait_times=3):
+    # 原run_forever中的实现：每次都对整个缓冲区rfind
+    commas = 0
+    sentence = ""
+    chunks = []
+    for delta in deltas:
+        sentence += delta
+        for x in ALL_MARKS if commas <= wait_times else HARD_MARKS:
+            pos = sentence.rfind(x)
+            if pos != -1:
+                chunk, sentence = sentence[:pos + 1], sentence[pos + 1:]
+                if commas <= wait_times:
+                    commas += sum([1 for c in chunk if c in set(ALL_MARKS)]) + 1
+                chunks.append(chunk)
+                break
+    return chunks
+
+
+def new_segment(deltas, wait_times=3):
+    segmenter = SentenceSegmenter(wait_times=wait_times)
+    chunks = []
+    for delta in deltas:
+        chunk = segmenter.feed(delta)
+        if chunk is not None:
+            chunks.append(chunk)
+    return chunks
+
+
+def main():
+    chars = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    deltas = make_deltas(chars)
+    for name, func in (("rfind", old_segment), ("segmenter", new_segment)):
+        seconds = timeit.timeit(lambda: func(deltas), number=rounds)
+        print(f"{name:>10}: {seconds / rounds * 1e6:8.1f} us/answer "
+              f"({len(deltas)} deltas, {len(func(deltas))} chunks)")
+
+
+if __name__ == "__main__":
+    main()
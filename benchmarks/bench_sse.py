@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Benchmark: SSE parsing of a recorded chat completion stream.
+
+    python benchmarks/bench_sse.py [stream.sse] [rounds]
+
+Replays the recording through an aiohttp StreamReader cut into random
+TCP-sized chunks, and compares the old line-based loop (`async for line in
+response.content`, decode, slice "data: ", string concatenation) with
+sseparser.aiter_deltas over `iter_any()` plus DeltaBuffer.
+"""
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+
+from aiohttp import StreamReader
+from aiohttp.base_protocol import BaseProtocol
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sseparser import DeltaBuffer, aiter_deltas  # noqa: E402
+
+RECORDED = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "chat_stream.sse")
+
+
+def split_chunks(raw, seed=0):
+    rng = random.Random(seed)
+    chunks = []
+    i = 0
+    while i < len(raw):
+        n = rng.randint(20, 600)
+        chunks.append(raw[i:i + n])
+        i += n
+    return chunks
+
+
+def make_reader(chunks):
+    loop = asyncio.get_running_loop()
+    reader = StreamReader(BaseProtocol(loop), 2 ** 16, loop=loop)
+    for chunk in chunks:
+        reader.feed_data(chunk)
+    reader.feed_eof()
+    return reader
+
+
+async def old_parse(content):
+    # 原ask_stream_async的做法
+    full_response = ""
+    async for line in content:
+        line = line.strip()
+        if not line:
+            continue
+        line = line.decode("utf-8")[6:]
+        if line == "[DONE]":
+            break
+        resp = json.loads(line)
+        choices = resp.get("choices")
+        if not choices:
+            continue
+        delta = choices[0].get("delta")
+        if not delta:
+            continue
+        if "content" in delta:
+            full_response += delta["content"]
+    return full_response
+
+
+async def new_parse(content):
+    full_response = DeltaBuffer()
+    async for delta in aiter_deltas(content.iter_any()):
+        if "content" in delta:
+            full_response.append(delta["content"])
+    return full_response.getvalue()
+
+
+async def bench(func, chunks, rounds):
+    readers = [make_reader(chunks) for _ in range(rounds)]
+    start = time.perf_counter()
+    for reader in readers:
+        await func(reader)
+    return time.perf_counter() - start
+
+
+async def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else RECORDED
+    rounds = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    with open(path, "rb") as f:
+        raw = f.read()
+    chunks = split_chunks(raw)
+    assert await old_parse(make_reader(chunks)) == await new_parse(make_reader(chunks))
+    for name, func in (("line-based", old_parse), ("sseparser", new_parse)):
+        seconds = await bench(func, chunks, rounds)
+        print(f"{name:>10}: {seconds / rounds * 1e6:8.1f} us/stream "
+              f"({len(raw)} bytes, {len(chunks)} chunks)")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark: how long until a freshly started MiGPT can answer.
+
+    python benchmarks/bench_startup.py [--runs 5]
+
+Every run is a new process (as after a crash or power cut) against
+benchmarks/fakeservers.py, and reports the time since process start to:
+imported (import MIGPT), ready (logged in, device found, poller primed,
+chatbot created) and tokenizer (encoding loaded in the background).
+The tokenizer needs network access or a filled TIKTOKEN_CACHE_DIR.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BENCHMARKS = os.path.dirname(os.path.abspath(__file__))
+STAGES = ("imported", "ready", "tokenizer")
+
+
+async def child(base, launched):
+    sys.path.insert(0, os.path.dirname(BENCHMARKS))
+    sys.path.insert(0, BENCHMARKS)
+    from MIGPT import MiGPT
+    imported = time.time() - launched
+
+    from bench_e2e import point_at, wait_for_server
+    from httppool import create_session
+
+    point_at(base)
+    times = {"imported": imported}
+    async with create_session() as session:
+        await wait_for_server(session, base)
+        miboy = MiGPT(hardware="LX06", mi_user="bench", mi_pass="bench", api_key="bench")
+        task = asyncio.create_task(miboy.run_forever(session))
+        while miboy.query_poller is None or miboy.chatbot is None:
+            if task.done():
+                task.result()
+            await asyncio.sleep(0.005)
+        times["ready"] = time.time() - launched
+        try:
+            await asyncio.wait_for(asyncio.shield(miboy.encoding_task), 60)
+            times["tokenizer"] = time.time() - launched
+        except Exception as e:
+            print(f"tokenizer failed: {e!r}", file=sys.stderr)
+        task.cancel()
+    print(json.dumps(times))
+
+
+def main(args):
+    base = f"http://127.0.0.1:{args.port}"
+    server = subprocess.Popen([
+        sys.executable, os.path.join(BENCHMARKS, "fakeservers.py"), "--port", str(args.port),
+    ])
+    results = []
+    try:
+        for _ in range(args.runs):
+            # 每次都是新的HOME，没有保存的token，需要完整登录
+            env = dict(os.environ, HOME=tempfile.mkdtemp(prefix="migpt-bench-"))
+            if os.environ.get("TIKTOKEN_CACHE_DIR") is None:
+                # 复用真实的tokenizer缓存，只测加载而不是下载
+                env["TIKTOKEN_CACHE_DIR"] = os.path.join(
+                    os.path.expanduser("~"), ".cache", "tiktoken"
+                )
+            out = subprocess.run(
+                [sys.executable, __file__, "--child", base, str(time.time())],
+                env=env,
+                stdout=subprocess.PIPE,
+                check=True,
+            ).stdout
+            results.append(json.loads(out.splitlines()[-1]))
+    finally:
+        server.terminate()
+        server.wait()
+    for stage in STAGES:
+        values = [r[stage] for r in results if stage in r]
+        if values:
+            print(f"{stage:>10}: median {statistics.median(values):.3f}s  max {max(values):.3f}s")
+        else:
+            print(f"{stage:>10}: unavailable")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "--child":
+        asyncio.run(child(sys.argv[2], float(sys.argv[3])))
+        sys.exit()
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8901)
+    parser.add_argument("--runs", type=int, default=5)
+    main(parser.parse_args())
@@ -0,0 +1,201 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Xiaomi and OpenAI endpoints used by MiGPT.
+
+    python benchmarks/fakeservers.py --port 8900
+
+Serves on one port:
+    /pass/serviceLogin, /pass/serviceLoginAuth2, /sts      小米账号登录
+    /admin/v2/device_list, /remote/ubus                    api2.mina.mi.com
+    /device_profile/v2/conversation                        userprofile.mina.mi.com
+    /v1/chat/completions                                   OpenAI兼容的SSE流
+    /_bench/ask, /_bench/stats, /_bench/reset              压测控制接口
+"""
+import argparse
+import asyncio
+import collections
+import json
+import time
+
+from aiohttp import web
+
+HARDWARE = "LX06"
+DEVICE_ID = "bench-device"
+ANSWER = (
+    "好的。今天是个好天气，适合出门走走。你可以去公园散步，也可以约朋友喝茶！"
+    "记得带上水和帽子，注意防晒。祝你玩得开心。"
+)
+
+
+class FakeSpeaker:
+    """
+    Simulated playback: every text_to_speech replaces what is playing and
+    lasts len(text) / chars_per_second seconds
+    """
+
+    def __init__(self, chars_per_second):
+        self.chars_per_second = chars_per_second
+        self.playing_until = 0
+
+    def is_playing(self):
+        return time.monotonic() < self.playing_until
+
+    def play(self, text):
+        now = time.monotonic()
+        self.playing_until = now + len(text) / self.chars_per_second
+        return now
+
+    def pause(self):
+        self.playing_until = 0
+
+
+class FakeServers:
+    def __init__(
+        self,
+        chars_per_second=5.0,
+        native_answer_seconds=1.5,
+        first_token_delay=0.4,
+        tokens_per_second=30.0,
+        answer=ANSWER,
+    ):
+        self.speaker = FakeSpeaker(chars_per_second)
+        self.native_answer_seconds = native_answer_seconds
+        self.first_token_delay = first_token_delay
+        self.tokens_per_second = tokens_per_second
+        self.answer = answer
+        self.records = []
+        self.reset()
+
+    def reset(self):
+        self.counts = collections.Counter()
+        self.events = []
+
+    def event(self, kind, **kwargs):
+        self.events.append(dict(kind=kind, t=time.monotonic(), **kwargs))
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route("*", "/pass/serviceLogin", self.service_login)
+        app.router.add_route("*", "/pass/serviceLoginAuth2", self.service_login)
+        app.router.add_get("/sts", self.sts)
+        app.router.add_get("/admin/v2/device_list", self.device_list)
+        app.router.add_post("/remote/ubus", self.ubus)
+        app.router.add_get("/device_profile/v2/conversation", self.conversation)
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_post("/_bench/ask", self.bench_ask)
+        app.router.add_get("/_bench/stats", self.bench_stats)
+        app.router.add_post("/_bench/reset", self.bench_reset)
+        return app
+
+    async def service_login(self, request):
+        self.counts["login"] += 1
+        resp = {
+            "code": 0,
+            "userId": "10000",
+            "passToken": "pass-token",
+            "location": f"{request.scheme}://{request.host}/sts?d=1",
+            "nonce": 1,
+            "ssecurity": "c2VjdXJpdHk=",
+        }
+        return web.Response(text="&&&START&&&" + json.dumps(resp))
+
+    async def sts(self, request):
+        response = web.Response(text="ok")
+        response.set_cookie("serviceToken", "service-token")
+        return response
+
+    async def device_list(self, request):
+        self.counts["device_list"] += 1
+        return web.json_response({
+            "code": 0,
+            "data": [{"hardware": HARDWARE, "deviceID": DEVICE_ID, "name": "bench"}],
+        })
+
+    async def ubus(self, request):
+        data = await request.post()
+        method = data.get("method")
+        message = json.loads(data.get("message", "{}"))
+        self.counts[method] += 1
+        info = {}
+        if method == "text_to_speech":
+            text = message.get("text", "")
+            was_playing = self.speaker.is_playing()
+            ends_at = self.speaker.playing_until
+            now = self.speaker.play(text)
+            if text:
+                self.event("tts", text=text, cut=was_playing, prev_end=ends_at,
+                           end=self.speaker.playing_until, start=now)
+        elif method == "player_play_operation" and message.get("action") == "pause":
+            self.speaker.pause()
+            self.event("pause")
+        elif method == "player_get_play_status":
+            info = {"status": 1 if self.speaker.is_playing() else 0}
+        return web.json_response({"code": 0, "data": {"code": 0, "info": json.dumps(info)}})
+
+    async def conversation(self, request):
+        self.counts["conversation"] += 1
+        limit = int(request.query.get("limit", 2))
+        records = sorted(self.records, key=lambda r: r["time"], reverse=True)[:limit]
+        return web.json_response({"code": 0, "data": json.dumps({"records": records})})
+
+    async def chat_completions(self, request):
+        self.counts["chat_completions"] += 1
+        self.event("llm_request")
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        await asyncio.sleep(self.first_token_delay)
+        chunk = {"choices": [{"delta": {"role": "assistant"}}]}
+        await response.write(b"data: " + json.dumps(chunk).encode() + b"\n\n")
+        for i in range(0, len(self.answer), 2):
+            chunk = {"choices": [{"delta": {"content": self.answer[i:i + 2]}}]}
+            await response.write(
+                b"data: " + json.dumps(chunk, ensure_ascii=False).encode() + b"\n\n"
+            )
+            await asyncio.sleep(1 / self.tokens_per_second)
+        await response.write(b"data: [DONE]\n\n")
+        self.event("llm_done")
+        return response
+
+    async def bench_ask(self, request):
+        body = await request.json()
+        record = {
+            "time": int(time.time() * 1000),
+            "query": body["query"],
+            "answers": [{"tts": {"text": "小爱的回答"}}],
+        }
+        self.records.append(record)
+        # 小爱先用自己的回答开始说话
+        self.speaker.play("x" * int(self.native_answer_seconds * self.speaker.chars_per_second))
+        self.event("ask", query=body["query"])
+        return web.json_response(record)
+
+    async def bench_stats(self, request):
+        return web.json_response({
+            "now": time.monotonic(),
+            "playing": self.speaker.is_playing(),
+            "counts": self.counts,
+            "events": self.events,
+        })
+
+    async def bench_reset(self, request):
+        self.reset()
+        return web.json_response({})
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--chars-per-second", type=float, default=5.0)
+    parser.add_argument("--first-token-delay", type=float, default=0.4)
+    parser.add_argument("--tokens-per-second", type=float, default=30.0)
+    args = parser.parse_args()
+    servers = FakeServers(
+        chars_per_second=args.chars_per_second,
+        first_token_delay=args.first_token_delay,
+        tokens_per_second=args.tokens_per_second,
+    )
+    web.run_app(servers.app(), host="127.0.0.1", port=args.port, print=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+import asyncio
+import logging
+import time
+
+from tracing import QUANTILES, Histogram
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class CommandTTS:
+    """
+    Speak through the micli command line without blocking the event loop.
+
+    Every sentence is one ``micli <command> <text>`` child process started
+    with create_subprocess_exec; at most ``max_concurrency`` run at once and
+    each is killed after ``timeout`` seconds or when the caller is cancelled.
+    """
+
+    def __init__(self, program="micli", max_concurrency=2, timeout=20.0, max_samples=1024):
+        self.program = program
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.semaphore = None  # 在事件循环中创建，兼容3.8/3.9
+        self.spawn_latency = Histogram(max_samples)  # 启动子进程的耗时
+        self.latency = Histogram(max_samples)  # 从启动到命令返回的耗时
+        self.failures = 0
+        self.timeouts = 0
+
+    async def speak(self, command, text):
+        """
+        Run one TTS command, return whether it succeeded
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        async with self.semaphore:
+            start = time.monotonic()
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    self.program,
+                    command,
+                    text,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE,
+                )
+            except OSError as e:
+                self.failures += 1
+                _LOGGER.warning("Start %s failed: %s", self.program, e)
+                return False
+            self.spawn_latency.observe(time.monotonic() - start)
+            try:
+                _, stderr = await asyncio.wait_for(process.communicate(), self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                _LOGGER.warning("%s %s timed out after %ss", self.program, command, self.timeout)
+                return False
+            finally:
+                if process.returncode is None:
+                    # 超时或被打断
+                    process.kill()
+                    await process.wait()
+            self.latency.observe(time.monotonic() - start)
+            if process.returncode != 0:
+                self.failures += 1
+                _LOGGER.warning(
+                    "%s %s exited with %s: %s",
+                    self.program, command, process.returncode,
+                    stderr.decode("utf-8", "replace").strip(),
+                )
+                return False
+            return True
+
+    def prometheus_text(self):
+        lines = []
+        for name, histogram in (
+            ("migpt_command_tts_spawn_seconds", self.spawn_latency),
+            ("migpt_command_tts_seconds", self.latency),
+        ):
+            lines.append(f"# TYPE {name} summary")
+            for q in QUANTILES:
+                lines.append(f'{name}{{quantile="{q}"}} {histogram.quantile(q):.4f}')
+            lines.append(f"{name}_sum {histogram.sum:.4f}")
+            lines.append(f"{name}_count {histogram.count}")
+        lines.append("# TYPE migpt_command_tts_failures_total counter")
+        lines.append(f"migpt_command_tts_failures_total {self.failures}")
+        lines.append("# TYPE migpt_command_tts_timeouts_total counter")
+        lines.append(f"migpt_command_tts_timeouts_total {self.timeouts}")
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,116 @@
+import collections
+import time
+
+
+class Conversation:
+    """
+    Messages of one conversation stored as (role, content, tokens) tuples,
+    with a running token total
+    """
+
+    __slots__ = ("messages", "total", "chars", "last_active")
+
+    def __init__(self):
+        self.messages = []
+        self.total = 0
+        self.chars = 0
+        self.last_active = time.time()
+
+    def append(self, role, content, tokens):
+        self.messages.append((role, content, tokens))
+        self.total += tokens
+        self.chars += len(content)
+
+    def pop(self, index=-1):
+        role, content, tokens = self.messages.pop(index)
+        self.total -= tokens
+        self.chars -= len(content)
+        return role, content
+
+    def splice(self, start, end, messages):
+        """
+        Replace messages[start:end] with (role, content, tokens) tuples
+        """
+        removed = self.messages[start:end]
+        self.messages[start:end] = messages
+        self.total += sum(m[2] for m in messages) - sum(m[2] for m in removed)
+        self.chars += sum(len(m[1]) for m in messages) - sum(len(m[1]) for m in removed)
+
+    def to_dicts(self):
+        return [{"role": role, "content": content} for role, content, _ in self.messages]
+
+    def __len__(self):
+        return len(self.messages)
+
+
+class ConversationManager:
+    """
+    Bounded convo_id -> Conversation mapping.
+
+    A conversation idle for more than ``idle_timeout`` seconds is dropped, so
+    a new topic starts fresh with a short prompt. Least recently used
+    conversations are evicted once there are more than ``max_conversations``
+    or their content exceeds ``max_chars`` in total.
+    """
+
+    def __init__(self, idle_timeout=None, max_conversations=64, max_chars=500_000):
+        self.idle_timeout = idle_timeout
+        self.max_conversations = max_conversations
+        self.max_chars = max_chars
+        self._conversations = collections.OrderedDict()
+
+    def get(self, convo_id):
+        """
+        Return the conversation if it exists and has not expired
+        """
+        conversation = self._conversations.get(convo_id)
+        if conversation is None:
+            return None
+        if self.is_expired(conversation.last_active):
+            del self._conversations[convo_id]
+            return None
+        return conversation
+
+    def is_expired(self, last_active):
+        return (
+            self.idle_timeout is not None
+            and time.time() - last_active > self.idle_timeout
+        )
+
+    def touch(self, convo_id):
+        conversation = self._conversations[convo_id]
+        conversation.last_active = time.time()
+        self._conversations.move_to_end(convo_id)
+
+    def enforce_limits(self):
+        """
+        Evict least recently used conversations, never the most recent one
+        """
+        chars = sum(c.chars for c in self._conversations.values())
+        while len(self._conversations) > 1 and (
+            len(self._conversations) > self.max_conversations or chars > self.max_chars
+        ):
+            _, conversation = self._conversations.popitem(last=False)
+            chars -= conversation.chars
+
+    def __getitem__(self, convo_id):
+        return self._conversations[convo_id]
+
+    def __setitem__(self, convo_id, conversation):
+        self._conversations[convo_id] = conversation
+        self._conversations.move_to_end(convo_id)
+
+    def __delitem__(self, convo_id):
+        del self._conversations[convo_id]
+
+    def __contains__(self, convo_id):
+        return convo_id in self._conversations
+
+    def __iter__(self):
+        return iter(self._conversations)
+
+    def __len__(self):
+        return len(self._conversations)
+
+    def items(self):
+        return self._conversations.items()
@@ -0,0 +1,122 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class DeviceRegistry:
+    """
+    Device list of one Xiaomi account, cached in memory and in a JSON file.
+
+    Lookups are served from indexes by deviceID, hardware model and name.
+    A list older than ``ttl`` is still served while a single background
+    refresh runs; an unknown device triggers one refresh before giving up.
+    """
+
+    def __init__(self, mina_service, path=None, ttl=24 * 3600):
+        self.mina_service = mina_service
+        self.path = path
+        self.ttl = ttl
+        self.devices = []
+        self.updated_at = 0
+        self.by_id = {}
+        self.by_hardware = {}
+        self.by_name = {}
+        self._refresh_task = None
+        self.load()
+
+    def _index(self, devices, updated_at):
+        self.devices = devices
+        self.updated_at = updated_at
+        self.by_id = {d.get("deviceID"): d for d in devices}
+        self.by_hardware = {}
+        self.by_name = {}
+        for d in devices:
+            self.by_hardware.setdefault(d.get("hardware", ""), []).append(d)
+            for name in (d.get("name"), d.get("alias")):
+                if name:
+                    self.by_name.setdefault(name, d)
+
+    @property
+    def is_stale(self):
+        return time.time() - self.updated_at > self.ttl
+
+    def load(self):
+        if not self.path or not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self._index(data["devices"], data["updated_at"])
+        except (OSError, ValueError, KeyError):
+            _LOGGER.exception("Exception on load devices from %s", self.path)
+
+    def save(self):
+        if not self.path:
+            return
+        tmp = self.path + ".tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(
+                    {"updated_at": self.updated_at, "devices": self.devices},
+                    f,
+                    ensure_ascii=False,
+                )
+            os.replace(tmp, self.path)
+        except OSError:
+            _LOGGER.exception("Exception on save devices to %s", self.path)
+
+    async def _refresh(self):
+        devices = await self.mina_service.device_list()
+        if devices is None:
+            raise Exception("device_list returned no data")
+        self._index(devices, time.time())
+        self.save()
+
+    async def refresh(self):
+        """
+        Fetch the device list; concurrent callers share one request
+        """
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.ensure_future(self._refresh())
+        await asyncio.shield(self._refresh_task)
+
+    def _refresh_in_background(self):
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return
+        self._refresh_task = asyncio.ensure_future(self._refresh())
+        self._refresh_task.add_done_callback(self._on_refreshed)
+
+    def _on_refreshed(self, task):
+        if not task.cancelled() and task.exception() is not None:
+            # 继续使用旧的列表
+            _LOGGER.warning("Refresh device list failed: %s", task.exception())
+
+    def _match(self, hardware=None, name=None, device_id=None):
+        if device_id:
+            device = self.by_id.get(device_id)
+            return device if device and (not hardware or device.get("hardware") == hardware) else None
+        if name:
+            device = self.by_name.get(name)
+            return device if device and (not hardware or device.get("hardware") == hardware) else None
+        devices = self.by_hardware.get(hardware)
+        return devices[0] if devices else None
+
+    async def find(self, hardware=None, name=None, device_id=None):
+        """
+        Return the device with device_id, or named name, or the first one of
+        the hardware model; None if there is none even after a refresh
+        """
+        if not self.devices:
+            await self.refresh()
+        elif self.is_stale:
+            self._refresh_in_background()
+        device = self._match(hardware, name, device_id)
+        if device is None and self.updated_at and time.time() - self.updated_at > 60:
+            # 可能是新添加的音箱，刷新一次再找
+            await self.refresh()
+            device = self._match(hardware, name, device_id)
+        return device
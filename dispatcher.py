@@ -0,0 +1,100 @@
+import asyncio
+import heapq
+import itertools
+import time
+
+# 数字越小越优先
+PRIORITY_HIGH = 0  # TTS、暂停等用户能感知到的操作
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2  # 状态轮询、设备列表
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self):
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def delay(self):
+        """
+        Seconds until the next token is available
+        """
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class Dispatcher:
+    """
+    Send the MiNA requests of one account through a token bucket of ``rate``
+    requests per second: every request actually sent, including retries and
+    hedged copies, takes a token in acquire(). When the bucket is empty,
+    waiting requests are let through by priority, then in arrival order.
+    Identical read requests submitted while one is in flight share its
+    result instead of being sent again.
+    """
+
+    def __init__(self, rate=20.0, burst=10):
+        self.bucket = TokenBucket(rate, burst)
+        self.deduplicated = 0
+        self.delayed = 0
+        self._waiters = []  # (priority, seq, future)
+        self._seq = itertools.count()
+        self._pump_task = None
+        self._inflight = {}
+
+    async def acquire(self, priority=PRIORITY_NORMAL):
+        """
+        Wait until one request of the given priority may be sent
+        """
+        if not self._waiters and self.bucket.try_take():
+            return
+        self.delayed += 1
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        if self._pump_task is None or self._pump_task.done():
+            self._pump_task = asyncio.ensure_future(self._pump())
+        await future
+
+    async def _pump(self):
+        while self._waiters:
+            if self._waiters[0][2].done():
+                # 等待者已被取消
+                heapq.heappop(self._waiters)
+            elif self.bucket.try_take():
+                heapq.heappop(self._waiters)[2].set_result(None)
+            else:
+                await asyncio.sleep(self.bucket.delay())
+
+    def _forget(self, key, task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # 没有人等待时也不报"never retrieved"
+
+    async def submit(self, request, key=None):
+        """
+        Await request(); requests with the same key share one call
+        """
+        if key is None:
+            return await request()
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = asyncio.ensure_future(request())
+            task.add_done_callback(lambda t: self._forget(key, t))
+        else:
+            self.deduplicated += 1
+        # 一个调用者被取消不影响其他共享结果的调用者
+        return await asyncio.shield(task)
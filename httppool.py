@@ -0,0 +1,105 @@
+import collections
+import ssl
+import time
+
+from aiohttp import ClientSession, ClientTimeout, TCPConnector, TraceConfig
+
+# 不同类型请求的超时设置
+TIMEOUTS = {
+    "poll": ClientTimeout(total=5, sock_connect=3),
+    "ubus": ClientTimeout(total=8, sock_connect=3),
+    "login": ClientTimeout(total=20, sock_connect=5),
+    # 流式回答可能很长，只限制连接和两次数据之间的间隔
+    "llm": ClientTimeout(total=None, sock_connect=10, sock_read=60),
+}
+
+
+class PoolStats:
+    """
+    Per-host request and connection counters collected through aiohttp tracing
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.requests = collections.Counter()
+        self.errors = collections.Counter()
+        self.new_connections = collections.Counter()
+        self.reused_connections = collections.Counter()
+        self.dns_hits = collections.Counter()
+        self.dns_misses = collections.Counter()
+
+    def trace_config(self):
+        trace_config = TraceConfig()
+        trace_config.on_request_start.append(self._on_request_start)
+        trace_config.on_request_exception.append(self._on_request_exception)
+        trace_config.on_connection_create_end.append(self._on_connection_create_end)
+        trace_config.on_connection_reuseconn.append(self._on_connection_reuseconn)
+        trace_config.on_dns_cache_hit.append(self._on_dns_cache_hit)
+        trace_config.on_dns_cache_miss.append(self._on_dns_cache_miss)
+        return trace_config
+
+    async def _on_request_start(self, session, ctx, params):
+        ctx.host = params.url.host
+        self.requests[ctx.host] += 1
+
+    async def _on_request_exception(self, session, ctx, params):
+        self.errors[params.url.host] += 1
+
+    async def _on_connection_create_end(self, session, ctx, params):
+        self.new_connections[getattr(ctx, "host", None)] += 1
+
+    async def _on_connection_reuseconn(self, session, ctx, params):
+        self.reused_connections[getattr(ctx, "host", None)] += 1
+
+    async def _on_dns_cache_hit(self, session, ctx, params):
+        self.dns_hits[params.host] += 1
+
+    async def _on_dns_cache_miss(self, session, ctx, params):
+        self.dns_misses[params.host] += 1
+
+    def snapshot(self):
+        hosts = set(self.requests) | set(self.new_connections)
+        return {
+            "uptime": round(time.monotonic() - self.started, 1),
+            "hosts": {
+                host: {
+                    "requests": self.requests[host],
+                    "errors": self.errors[host],
+                    "new_connections": self.new_connections[host],
+                    "reused_connections": self.reused_connections[host],
+                    "dns_hits": self.dns_hits[host],
+                    "dns_misses": self.dns_misses[host],
+                }
+                for host in sorted(hosts, key=str)
+            },
+        }
+
+
+def create_session(
+    limit=100,
+    limit_per_host=8,
+    keepalive_timeout=60,
+    ttl_dns_cache=600,
+    stats=None,
+    **kwargs,
+):
+    """
+    Create the ClientSession shared by the Xiaomi and LLM requests.
+
+    Connections are kept alive per host, DNS answers are cached and one SSL
+    context is shared so every TTS call and status poll reuses a warm
+    connection instead of paying a new TLS handshake.
+    """
+    connector = TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        keepalive_timeout=keepalive_timeout,
+        use_dns_cache=True,
+        ttl_dns_cache=ttl_dns_cache,
+        ssl=ssl.create_default_context(),
+    )
+    return ClientSession(
+        connector=connector,
+        trace_configs=[stats.trace_config()] if stats is not None else None,
+        **kwargs,
+    )
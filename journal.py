@@ -0,0 +1,178 @@
+import asyncio
+import json
+import logging
+import os
+from urllib.parse import quote
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class ConversationJournal:
+    """
+    Append-only store for Chatbot conversations, one JSONL file per convo_id.
+
+    Messages are (role, content, ...) tuples. Every change is one compact
+    record: {"a": [role, content]} appends a message, {"p": index} pops one
+    and {"r": [[role, content], ...]} replaces the whole conversation (reset
+    and compaction). Records are flushed on write; on an event loop they are
+    fsynced in a worker thread once ``fsync_every`` are pending, or at most
+    ``fsync_interval`` seconds after the first unsynced write, so a question
+    never waits for the disk. Without a running loop every write is synced
+    at once. Files are replayed lazily on first use.
+    """
+
+    def __init__(
+        self,
+        directory,
+        fsync_every=16,
+        fsync_interval=2.0,
+        compact_ratio=4,
+        max_open_files=32,
+    ):
+        self.directory = directory
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.compact_ratio = compact_ratio
+        self.max_open_files = max_open_files
+        self._files = {}
+        self._records = {}  # convo_id -> 文件中的记录数
+        self._unsynced = 0
+        self._sync_handle = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, convo_id):
+        return os.path.join(self.directory, quote(convo_id, safe="") + ".jsonl")
+
+    def load(self, convo_id):
+        """
+        Replay the journal of convo_id, return its (role, content) pairs or None
+        """
+        path = self._path(convo_id)
+        if not os.path.isfile(path):
+            return None
+        messages = []
+        records = 0
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # 崩溃时写了一半的最后一行
+                    _LOGGER.warning("Skip broken record in %s", path)
+                    continue
+                records += 1
+                if "a" in record:
+                    messages.append(tuple(record["a"]))
+                elif "p" in record:
+                    if messages:
+                        messages.pop(record["p"])
+                elif "r" in record:
+                    messages = [tuple(m) for m in record["r"]]
+        self._records[convo_id] = records
+        return messages
+
+    def mtime(self, convo_id):
+        """
+        Time of the last write to the journal of convo_id, None if there is none
+        """
+        try:
+            return os.path.getmtime(self._path(convo_id))
+        except OSError:
+            return None
+
+    def append(self, convo_id, role, content):
+        self._write(convo_id, {"a": [role, content]})
+
+    def pop(self, convo_id, index=-1):
+        self._write(convo_id, {"p": index})
+
+    def replace(self, convo_id, messages):
+        self._write(convo_id, {"r": [[m[0], m[1]] for m in messages]})
+
+    def maybe_compact(self, convo_id, messages):
+        """
+        Rewrite the journal as one snapshot once it holds compact_ratio
+        times more records than live messages
+        """
+        if self._records.get(convo_id, 0) <= self.compact_ratio * max(len(messages), 8):
+            return False
+        self.compact(convo_id, messages)
+        return True
+
+    def compact(self, convo_id, messages):
+        self._close_file(convo_id)
+        path = self._path(convo_id)
+        tmp = path + ".tmp"
+        record = {"r": [[m[0], m[1]] for m in messages]}
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        self._records[convo_id] = 1
+
+    def _write(self, convo_id, record):
+        f = self._files.get(convo_id)
+        if f is None:
+            if len(self._files) >= self.max_open_files:
+                self._close_file(next(iter(self._files)))
+            f = self._files[convo_id] = open(self._path(convo_id), "a", encoding="utf-8")
+        f.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        f.flush()
+        self._records[convo_id] = self._records.get(convo_id, 0) + 1
+        self._unsynced += 1
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self.sync()
+            return
+        if self._unsynced >= self.fsync_every:
+            self._schedule_sync(loop, 0)
+        elif self._sync_handle is None:
+            # 一轮问答的最后几条记录不能等到下一次写入才落盘
+            self._schedule_sync(loop, self.fsync_interval)
+
+    def _schedule_sync(self, loop, delay):
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+        self._sync_handle = loop.call_later(delay, self._sync_in_background, loop)
+
+    def _sync_in_background(self, loop):
+        self._sync_handle = None
+        if not self._unsynced:
+            return
+        # 复制文件描述符，线程里fsync时文件被关闭也没关系
+        fds = [os.dup(f.fileno()) for f in self._files.values()]
+        self._unsynced = 0
+        loop.run_in_executor(None, self._fsync_all, fds)
+
+    def _fsync_all(self, fds):
+        for fd in fds:
+            try:
+                os.fsync(fd)
+            except OSError:
+                _LOGGER.exception("Exception on sync journal in %s", self.directory)
+            finally:
+                os.close(fd)
+
+    def sync(self):
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        for f in self._files.values():
+            os.fsync(f.fileno())
+        self._unsynced = 0
+
+    def _close_file(self, convo_id):
+        f = self._files.pop(convo_id, None)
+        if f is not None:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+
+    def close(self):
+        if self._sync_handle is not None:
+            self._sync_handle.cancel()
+            self._sync_handle = None
+        for convo_id in list(self._files):
+            self._close_file(convo_id)
@@ -0,0 +1,155 @@
+"""
+Pool of OpenAI-compatible chat completion endpoints with hedging and failover
+"""
+import asyncio
+import collections
+import logging
+import time
+
+from sseparser import aiter_deltas
+
+_LOGGER = logging.getLogger(__package__)
+
+_Stream = collections.namedtuple("_Stream", "backend response deltas buffered")
+
+
+class Backend:
+    """
+    One chat completions endpoint. url, api_key, engine and proxy default to
+    the Chatbot's own settings when None.
+    """
+
+    def __init__(self, url=None, api_key=None, engine=None, proxy=None, name=None):
+        self.url = url
+        self.api_key = api_key
+        self.engine = engine
+        self.proxy = proxy
+        self.name = name or url or "default"
+        self.ttft = None  # 首个token延迟的滑动平均
+        self.failures = 0  # 连续失败次数
+        self.down_until = 0.0
+        self.wins = 0
+
+    def record_success(self, ttft, smoothing=0.3):
+        self.failures = 0
+        self.down_until = 0.0
+        self.ttft = ttft if self.ttft is None else self.ttft + smoothing * (ttft - self.ttft)
+
+    def record_failure(self, threshold, cooldown):
+        self.failures += 1
+        if self.failures >= threshold:
+            self.down_until = time.monotonic() + cooldown
+
+    @property
+    def is_healthy(self):
+        return self.down_until <= time.monotonic()
+
+
+class BackendPool:
+    """
+    Try backends in order, skipping the ones that failed ``failure_threshold``
+    times in a row for ``cooldown`` seconds. With ``hedge_delay``, a second
+    backend is started when the first has not produced a token in time; the
+    first to stream wins and the other request is cancelled.
+    """
+
+    def __init__(self, backends, hedge_delay=None, failure_threshold=3, cooldown=30.0):
+        self.backends = list(backends)
+        self.hedge_delay = hedge_delay
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+    def candidates(self):
+        healthy = [b for b in self.backends if b.is_healthy]
+        # 全部不可用时仍然按顺序尝试
+        return healthy + [b for b in self.backends if not b.is_healthy]
+
+    async def _open(self, backend, open_stream):
+        """
+        Start a stream and read it up to the first content delta
+        """
+        start = time.monotonic()
+        response = await open_stream(backend)
+        try:
+            if response.status != 200:
+                raise Exception(
+                    f"Error: {response.status} {response.reason} {await response.text()}",
+                )
+            deltas = aiter_deltas(response.content.iter_any())
+            buffered = []
+            async for delta in deltas:
+                buffered.append(delta)
+                if "content" in delta:
+                    break
+        except BaseException:
+            response.close()
+            raise
+        backend.record_success(time.monotonic() - start)
+        return _Stream(backend, response, deltas, buffered)
+
+    @staticmethod
+    def _discard(task):
+        # 输掉的请求如果已经开始输出，关闭它的连接
+        if not task.cancelled() and task.exception() is None:
+            task.result().response.close()
+
+    async def stream(self, open_stream):
+        """
+        Yield the deltas of the winning backend. open_stream(backend) must
+        return the (not yet read) aiohttp response of the request.
+        """
+        candidates = self.candidates()
+        pending = {}
+        hedged = False
+        error = None
+        winner = None
+
+        def start_next():
+            if candidates:
+                backend = candidates.pop(0)
+                pending[asyncio.ensure_future(self._open(backend, open_stream))] = backend
+
+        start_next()
+        try:
+            while pending:
+                timeout = None
+                if self.hedge_delay is not None and not hedged and candidates:
+                    timeout = self.hedge_delay
+                done, _ = await asyncio.wait(
+                    pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    # 第一个后端迟迟没有输出，同时请求下一个
+                    hedged = True
+                    start_next()
+                    continue
+                for task in done:
+                    backend = pending.pop(task)
+                    if task.exception() is None:
+                        winner = task.result()
+                        break
+                    error = task.exception()
+                    backend.record_failure(self.failure_threshold, self.cooldown)
+                    _LOGGER.warning("LLM backend %s failed: %s", backend.name, error)
+                if winner is not None:
+                    break
+                if not pending:
+                    start_next()  # 失败转移
+        finally:
+            for task in pending:
+                task.cancel()
+                task.add_done_callback(self._discard)
+        if winner is None:
+            raise error
+        winner.backend.wins += 1
+        try:
+            for delta in winner.buffered:
+                yield delta
+            async for delta in winner.deltas:
+                yield delta
+        except BaseException:
+            winner.response.close()
+            raise
+        finally:
+            await winner.deltas.aclose()
+        winner.response.release()
@@ -1,3 +1,4 @@
+import asyncio
 import base64
 import hashlib
 import json
@@ -5,11 +6,22 @@ import logging
 import os
 import random
 import string
+import time
 from urllib import parse
-from aiohttp import ClientSession
+from aiohttp import ClientConnectorError, ClientError, ClientSession
+from dispatcher import PRIORITY_NORMAL, Dispatcher
+from httppool import TIMEOUTS
+from resilience import (
+    MiAuthError,
+    MiNetworkError,
+    RequestPolicy,
+    classify_response,
+)
 
 _LOGGER = logging.getLogger(__package__)
 
+ACCOUNT_URL = "https://account.xiaomi.com/pass/"
+
 
 def get_random(length):
     return "".join(random.sample(string.ascii_letters + string.digits, length))
@@ -40,7 +52,17 @@ class MiTokenStore:
 
 
 class MiAccount:
-    def __init__(self, session: ClientSession, username, password, token_store=None):
+    def __init__(
+        self,
+        session: ClientSession,
+        username,
+        password,
+        token_store=None,
+        token_max_age=7 * 24 * 3600,
+        refresh_margin=3600,
+        policy=None,
+        dispatcher=None,
+    ):
         self.session = session
         self.username = username
         self.password = password
@@ -48,6 +70,51 @@ class MiAccount:
             MiTokenStore(token_store) if isinstance(token_store, str) else token_store
         )
         self.token = token_store is not None and self.token_store.load_token()
+        self.token_max_age = token_max_age
+        self.refresh_margin = refresh_margin
+        self._login_lock = asyncio.Lock()
+        # 共用同一个账号的请求共用重试和熔断策略
+        self.policy = policy or RequestPolicy()
+        self.dispatcher = dispatcher or Dispatcher()  # MiNA请求的限速和优先级
+
+    def token_is_valid(self, sid):
+        if not self.token or sid not in self.token:
+            return False
+        issued = self.token.get("issued", {}).get(sid)
+        if issued is None:
+            # 旧版本保存的token没有签发时间，用到认证失败为止
+            return True
+        return time.time() < issued + self.token_max_age - self.refresh_margin
+
+    async def ensure_token(self, sid):
+        """
+        Reuse the in-memory (or stored) token, login only if missing or near expiry
+        """
+        if self.token_is_valid(sid):
+            return True
+        return await self.refresh(sid)
+
+    async def refresh(self, sid, stale_token=None):
+        """
+        Refresh the token of sid; concurrent callers share a single login.
+        stale_token is the serviceToken the caller saw fail, if any.
+        """
+        async with self._login_lock:
+            if self.token_is_valid(sid) and (
+                stale_token is None or self.token[sid][1] != stale_token
+            ):
+                # 等锁期间别的请求已经刷新过了
+                return True
+            breaker = self.policy.breaker("login")
+            if not breaker.allow():
+                # 连续登录失败，暂停一段时间，避免服务故障时反复登录
+                _LOGGER.warning("Skip login %s, too many failures", self.username)
+                return False
+            if await self.login(sid):
+                breaker.record_success()
+                return True
+            breaker.record_failure()
+            return False
 
     async def login(self, sid):
         if not self.token:
@@ -75,6 +142,7 @@ class MiAccount:
                 resp["location"], resp["nonce"], resp["ssecurity"]
             )
             self.token[sid] = (resp["ssecurity"], serviceToken)
+            self.token.setdefault("issued", {})[sid] = time.time()
             if self.token_store:
                 self.token_store.save_token(self.token)
             return True
@@ -94,7 +162,7 @@ class MiAccount:
         if "passToken" in self.token:
             cookies["userId"] = self.token["userId"]
             cookies["passToken"] = self.token["passToken"]
-        url = "https://account.xiaomi.com/pass/" + uri
+        url = ACCOUNT_URL + uri
         async with self.session.request(
             "GET" if data is None else "POST",
             url,
@@ -102,6 +170,7 @@ class MiAccount:
             cookies=cookies,
             headers=headers,
             ssl = False,
+            timeout=TIMEOUTS["login"],
         ) as r:
             raw = await r.read()
         resp = json.loads(raw[11:])
@@ -112,39 +181,84 @@ class MiAccount:
         nsec = "nonce=" + str(nonce) + "&" + ssecurity
         clientSign = base64.b64encode(hashlib.sha1(nsec.encode()).digest()).decode()
         async with self.session.get(
-            location + "&clientSign=" + parse.quote(clientSign)
+            location + "&clientSign=" + parse.quote(clientSign),
+            timeout=TIMEOUTS["login"],
         ) as r:
             serviceToken = r.cookies["serviceToken"].value
             if not serviceToken:
                 raise Exception(await r.text())
         return serviceToken
 
-    async def mi_request(self, sid, url, data, headers, relogin=True):
-        if (self.token and sid in self.token) or await self.login(sid):  # Ensure login
-            cookies = {
-                "userId": self.token["userId"],
-                "serviceToken": self.token[sid][1],
-            }
-            content = data(self.token, cookies) if callable(data) else data
-            method = "GET" if data is None else "POST"
-            _LOGGER.info("%s %s", url, content)
+    async def _mi_request_once(self, sid, url, data, headers, timeout):
+        if not await self.ensure_token(sid):  # Ensure login
+            raise MiAuthError(f"Error {url}: Login failed")
+        cookies = {
+            "userId": self.token["userId"],
+            "serviceToken": self.token[sid][1],
+        }
+        content = data(self.token, cookies) if callable(data) else data
+        method = "GET" if data is None else "POST"
+        _LOGGER.info("%s %s", url, content)
+        try:
             async with self.session.request(
-                method, url, data=content, cookies=cookies, headers=headers
+                method,
+                url,
+                data=content,
+                cookies=cookies,
+                headers=headers,
+                timeout=timeout or TIMEOUTS["ubus"],
             ) as r:
                 status = r.status
                 if status == 200:
-                    resp = await r.json(content_type=None)
-                    code = resp["code"]
+                    try:
+                        resp = await r.json(content_type=None)
+                        code = resp["code"]
+                    except (ValueError, KeyError, TypeError) as e:
+                        # 网关返回的HTML页面等，按网络错误处理
+                        raise MiNetworkError(f"Error {url}: bad response {e!r}") from e
                     if code == 0:
                         return resp
-                    if "auth" in resp.get("message", "").lower():
-                        status = 401
                 else:
                     resp = await r.text()
-            if status == 401 and relogin:
-                _LOGGER.warn("Auth error on request %s %s, relogin...", url, resp)
-                self.token = None  # Auth error, reset login
-                return await self.mi_request(sid, url, data, headers, False)
-        else:
-            resp = "Login failed"
-        raise Exception(f"Error {url}: {resp}")
+        except ClientConnectorError as e:
+            # 连接没有建立，请求肯定没有发出
+            raise MiNetworkError(f"Error {url}: {e!r}", maybe_sent=False) from e
+        except (ClientError, asyncio.TimeoutError) as e:
+            raise MiNetworkError(f"Error {url}: {e!r}") from e
+        error = classify_response(status, resp)
+        if error is MiAuthError:
+            raise MiAuthError(f"Error {url}: {resp}", service_token=cookies["serviceToken"])
+        raise error(f"Error {url}: {status} {resp}")
+
+    async def mi_request(
+        self,
+        sid,
+        url,
+        data,
+        headers,
+        relogin=True,
+        timeout=None,
+        hedge_delay=None,
+        idempotent=True,
+        endpoint=None,
+        priority=PRIORITY_NORMAL,
+    ):
+        async def attempt():
+            # 每次真正发出的请求（包括重试和对冲）都要经过限速
+            await self.dispatcher.acquire(priority)
+            return await self._mi_request_once(sid, url, data, headers, timeout)
+
+        try:
+            return await self.policy.call(
+                endpoint or url.split("?", 1)[0], attempt, hedge_delay, idempotent
+            )
+        except MiAuthError as e:
+            if not relogin or e.service_token is None:
+                raise
+            _LOGGER.warning("Auth error on request %s %s, relogin...", url, e)
+            # Auth error, refresh once (shared with concurrent requests)
+            if not await self.refresh(sid, e.service_token):
+                raise
+        return await self.mi_request(
+            sid, url, data, headers, False, timeout, hedge_delay, idempotent, endpoint, priority
+        )
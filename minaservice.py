@@ -1,16 +1,46 @@
 import json
+from dispatcher import PRIORITY_HIGH, PRIORITY_LOW, PRIORITY_NORMAL
+from httppool import TIMEOUTS
 from miaccount import MiAccount, get_random
 
 import logging
 
 _LOGGER = logging.getLogger(__package__)
 
+MINA_URL = "https://api2.mina.mi.com"
+
+# 用户能听到的操作优先，状态查询排在后面
+UBUS_PRIORITIES = {
+    "text_to_speech": PRIORITY_HIGH,
+    "player_play_operation": PRIORITY_HIGH,
+    "player_set_volume": PRIORITY_HIGH,
+    "player_play_url": PRIORITY_HIGH,
+    "player_get_play_status": PRIORITY_LOW,
+}
+# 只读请求，同时发出的相同请求合并为一次
+UBUS_READ_METHODS = {"player_get_play_status"}
+# 重复执行会重复播放，可能已经发出的请求不再重试
+UBUS_UNSAFE_METHODS = {"text_to_speech", "player_play_url"}
+
 
 class MiNAService:
-    def __init__(self, account: MiAccount):
+    def __init__(self, account: MiAccount, tts_hedge_delay=None):
         self.account = account
+        # TTS迟迟没有返回时再发一个相同的请求，可能导致重复播报，默认关闭
+        self.tts_hedge_delay = tts_hedge_delay
 
-    async def mina_request(self, uri, data=None):
+    async def mina_request(
+        self,
+        uri,
+        data=None,
+        timeout=None,
+        hedge_delay=None,
+        priority=PRIORITY_NORMAL,
+        dedupe=False,
+        idempotent=True,
+        endpoint=None,
+    ):
+        key = (uri, json.dumps(data, sort_keys=True)) if dedupe else None
         requestId = "app_ios_" + get_random(30)
         if data is not None:
             data["requestId"] = requestId
@@ -19,25 +49,46 @@ class MiNAService:
         headers = {
             "User-Agent": "MiHome/6.0.103 (com.xiaomi.mihome; build:6.0.103.1; iOS 14.4.0) Alamofire/6.0.103 MICO/iOSApp/appStore/6.0.103"
         }
-        return await self.account.mi_request(
-            "micoapi", "https://api2.mina.mi.com" + uri, data, headers
+        # 同时发出的相同只读请求合并为一次，每次真正发出时再按账号限速
+        return await self.account.dispatcher.submit(
+            lambda: self.account.mi_request(
+                "micoapi",
+                MINA_URL + uri,
+                data,
+                headers,
+                timeout=timeout,
+                hedge_delay=hedge_delay,
+                idempotent=idempotent,
+                endpoint=endpoint,
+                priority=priority,
+            ),
+            key,
         )
 
     async def device_list(self, master=0):
-        result = await self.mina_request("/admin/v2/device_list?master=" + str(master))
+        result = await self.mina_request(
+            "/admin/v2/device_list?master=" + str(master), priority=PRIORITY_LOW, dedupe=True
+        )
         return result.get("data") if result else None
 
-    async def ubus_request(self, deviceId, method, path, message):
+    async def ubus_request(self, deviceId, method, path, message, hedge_delay=None):
         message = json.dumps(message)
         result = await self.mina_request(
             "/remote/ubus",
             {"deviceId": deviceId, "message": message, "method": method, "path": path},
+            timeout=TIMEOUTS["ubus"],
+            hedge_delay=hedge_delay,
+            priority=UBUS_PRIORITIES.get(method, PRIORITY_NORMAL),
+            dedupe=method in UBUS_READ_METHODS,
+            idempotent=method not in UBUS_UNSAFE_METHODS,
+            # 每个ubus方法单独熔断，状态轮询失败不影响TTS和暂停
+            endpoint=f"{MINA_URL}/remote/ubus/{method}",
         )
         return result
 
     async def text_to_speech(self, deviceId, text):
         return await self.ubus_request(
-            deviceId, "text_to_speech", "mibrain", {"text": text}
+            deviceId, "text_to_speech", "mibrain", {"text": text}, self.tts_hedge_delay
         )
 
     async def player_set_volume(self, deviceId, volume):
@@ -0,0 +1,168 @@
+import asyncio
+import collections
+import json
+import logging
+import random
+import time
+
+from aiohttp import ClientSession
+from httppool import TIMEOUTS
+
+_LOGGER = logging.getLogger(__package__)
+
+LATEST_ASK_API = "https://userprofile.mina.mi.com/device_profile/v2/conversation?source=dialogu&hardware={hardware}&timestamp={timestamp}&limit={limit}"
+
+
+class QueryAuthError(Exception):
+    pass
+
+
+class QueryError(Exception):
+    """
+    A bad response that is worth retrying on the next poll
+    """
+
+
+def parse_records(data):
+    if d := data.get("data"):
+        try:
+            records = json.loads(d).get("records") or []
+        except (ValueError, TypeError, AttributeError) as e:
+            raise QueryError(f"bad records {d!r:.200}: {e}") from e
+        return [r for r in records if isinstance(r, dict)]
+    return []
+
+
+class QueryPoller:
+    """
+    Poll LATEST_ASK_API for new questions.
+
+    Polls every ``fast_interval`` seconds for ``boost_time`` seconds after a
+    boost (a new query, the speaker waking up, an active answer), then backs
+    off exponentially from ``idle_interval`` to ``max_interval``. Every record
+    newer than ``last_timestamp`` is queued in ``pending``, oldest first,
+    counted in ``received`` and wakes up everyone in ``wait_new_query``.
+    """
+
+    def __init__(
+        self,
+        session: ClientSession,
+        hardware,
+        cookies,
+        limit=5,
+        fast_interval=0.1,
+        idle_interval=0.25,
+        max_interval=2.0,
+        backoff=1.5,
+        jitter=0.1,
+        boost_time=10.0,
+    ):
+        self.session = session
+        self.hardware = hardware
+        self.cookies = cookies  # 构建一次，之后每次轮询复用
+        self.limit = limit
+        self.fast_interval = fast_interval
+        self.idle_interval = idle_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.boost_time = boost_time
+        self.last_timestamp = 0
+        self.pending = collections.deque()
+        self.received = 0  # 累计入队的记录数
+        self.new_query = asyncio.Event()
+        self._interval = idle_interval
+        self._boost_until = 0
+        self._wakeup = asyncio.Event()
+
+    async def fetch(self):
+        async with self.session.get(
+            LATEST_ASK_API.format(
+                hardware=self.hardware,
+                timestamp=str(int(time.time() * 1000)),
+                limit=self.limit,
+            ),
+            cookies=self.cookies,
+            timeout=TIMEOUTS["poll"],
+        ) as r:
+            if r.status == 401:
+                raise QueryAuthError(r.status)
+            if r.status != 200:
+                raise QueryError(f"{r.status} {r.reason}")
+            try:
+                data = await r.json(content_type=None)
+            except ValueError as e:
+                # 网关返回的HTML错误页等
+                raise QueryError(f"invalid json: {e}") from e
+        if not isinstance(data, dict):
+            raise QueryError(f"unexpected response {data!r:.200}")
+        if data.get("code") == 401:
+            raise QueryAuthError(data)
+        return data
+
+    async def prime(self):
+        """
+        Skip everything asked before we started
+        """
+        records = parse_records(await self.fetch())
+        if records:
+            self.last_timestamp = max(r.get("time", 0) for r in records)
+        return records[0] if records else None
+
+    async def poll(self):
+        """
+        Fetch once and queue the records we have not seen yet
+        """
+        records = [
+            r for r in parse_records(await self.fetch())
+            if r.get("time", 0) > self.last_timestamp
+        ]
+        if records:
+            records.sort(key=lambda r: r.get("time", 0))
+            if len(records) == self.limit:
+                _LOGGER.warning("Got %d new queries at once, some may be missed", self.limit)
+            self.last_timestamp = records[-1].get("time")
+            self.pending.extend(records)
+            self.received += len(records)
+            self.new_query.set()
+            self.boost()
+        return records
+
+    def boost(self, duration=None):
+        """
+        Poll fast for a while, e.g. right after the speaker woke up
+        """
+        self._boost_until = time.monotonic() + (duration or self.boost_time)
+        self._interval = self.idle_interval
+        self._wakeup.set()  # 结束正在进行的慢速等待
+
+    def next_interval(self):
+        if time.monotonic() < self._boost_until:
+            interval = self.fast_interval
+        else:
+            interval = self._interval
+            self._interval = min(self._interval * self.backoff, self.max_interval)
+        return interval * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def queued_after(self, received):
+        """
+        Pending records queued after ``received`` was the given count, oldest first
+        """
+        count = min(self.received - received, len(self.pending))
+        return list(self.pending)[len(self.pending) - count:] if count > 0 else []
+
+    async def wait_new_query(self, after=None):
+        """
+        Return once there is a pending record; with ``after``, once a record
+        was queued after ``received`` was ``after``
+        """
+        while not self.pending if after is None else self.received <= after:
+            self.new_query.clear()
+            await self.new_query.wait()
+
+    async def wait(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.next_interval())
+        except asyncio.TimeoutError:
+            pass
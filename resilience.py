@@ -0,0 +1,210 @@
+"""
+Retry, circuit breaker and hedging policy for requests to Xiaomi services
+"""
+import asyncio
+import collections
+import logging
+import random
+import time
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class MiRequestError(Exception):
+    """
+    A request that failed for good, e.g. a bad parameter; not retried
+    """
+
+    kind = "error"
+    maybe_sent = True  # 请求可能已经被服务端执行
+
+
+class MiAuthError(MiRequestError):
+    """
+    The serviceToken was rejected (or login failed), a new token is needed
+    """
+
+    kind = "auth"
+
+    def __init__(self, *args, service_token=None):
+        super().__init__(*args)
+        self.service_token = service_token  # 被拒绝的token，没有发出请求时为None
+
+
+class MiThrottleError(MiRequestError):
+    kind = "throttle"
+    maybe_sent = False
+
+
+class MiNetworkError(MiRequestError):
+    """
+    Connection errors, timeouts and 5xx responses
+    """
+
+    kind = "network"
+
+    def __init__(self, *args, maybe_sent=True):
+        super().__init__(*args)
+        self.maybe_sent = maybe_sent  # 连接没有建立时为False
+
+
+class CircuitOpenError(MiNetworkError):
+    kind = "circuit_open"
+
+
+TRANSIENT_ERRORS = (MiNetworkError, MiThrottleError)
+
+_THROTTLE_WORDS = ("too many", "frequent", "limit", "频繁")
+
+
+def classify_response(status, resp):
+    """
+    Return the error class for a failed response, resp is the JSON body or text
+    """
+    message = resp.get("message", "") if isinstance(resp, dict) else str(resp)
+    message = message.lower()
+    if status == 401 or "auth" in message:
+        return MiAuthError
+    if status == 429 or any(word in message for word in _THROTTLE_WORDS):
+        return MiThrottleError
+    if status >= 500:
+        return MiNetworkError
+    return MiRequestError
+
+
+class CircuitBreaker:
+    """
+    Open after ``failure_threshold`` consecutive transient failures, then let
+    one trial request through every ``reset_timeout`` seconds until one succeeds
+    """
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self):
+        state = self.state
+        if state == "half_open":
+            # 只放行一个试探请求，失败后重新计时
+            self.opened_at = time.monotonic()
+            return True
+        return state == "closed"
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            if self.opened_at is None:
+                _LOGGER.warning("Circuit opened after %d failures", self.failures)
+            self.opened_at = time.monotonic()
+
+
+async def hedge(request, delay):
+    """
+    Run request(); if it has not finished after delay seconds, start a second
+    copy and return whichever succeeds first
+    """
+    first = asyncio.ensure_future(request())
+    done, _ = await asyncio.wait([first], timeout=delay)
+    if done:
+        return first.result()
+    pending = {first, asyncio.ensure_future(request())}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+class RequestPolicy:
+    """
+    Retry transient errors with capped exponential backoff and full jitter,
+    behind one circuit breaker per endpoint. Auth and permanent errors are
+    raised right away; throttling backs off ``throttle_factor`` times longer
+    but does not count towards opening the circuit.
+    Requests that are not idempotent are only retried when they surely did
+    not reach the server.
+    """
+
+    def __init__(
+        self,
+        attempts=3,
+        base_delay=0.2,
+        max_delay=5.0,
+        throttle_factor=5,
+        failure_threshold=5,
+        reset_timeout=30.0,
+    ):
+        self.attempts = attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.throttle_factor = throttle_factor
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.breakers = {}
+        self.errors = collections.Counter()  # 按错误类型统计
+
+    def breaker(self, endpoint):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                self.failure_threshold, self.reset_timeout
+            )
+        return breaker
+
+    def backoff(self, attempt, throttled=False):
+        delay = self.base_delay * (self.throttle_factor if throttled else 1)
+        return random.uniform(0, min(self.max_delay, delay * 2 ** attempt))
+
+    async def call(self, endpoint, request, hedge_delay=None, idempotent=True):
+        """
+        Await request() under the policy of endpoint
+        """
+        breaker = self.breaker(endpoint)
+        for attempt in range(self.attempts):
+            if not breaker.allow():
+                self.errors[CircuitOpenError.kind] += 1
+                raise CircuitOpenError(f"Circuit open for {endpoint}")
+            try:
+                if hedge_delay is None:
+                    result = await request()
+                else:
+                    result = await hedge(request, hedge_delay)
+            except TRANSIENT_ERRORS as e:
+                if not isinstance(e, MiThrottleError):
+                    # 被限流说明服务是通的，只退避不熔断
+                    breaker.record_failure()
+                self.errors[e.kind] += 1
+                if attempt + 1 >= self.attempts or (not idempotent and e.maybe_sent):
+                    raise
+                delay = self.backoff(attempt, isinstance(e, MiThrottleError))
+                _LOGGER.info("Retry %s in %.2fs after %s", endpoint, delay, e)
+                await asyncio.sleep(delay)
+                continue
+            except MiRequestError as e:
+                # 服务端有正常响应，说明链路是通的
+                breaker.record_success()
+                self.errors[e.kind] += 1
+                raise
+            breaker.record_success()
+            return result
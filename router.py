@@ -0,0 +1,232 @@
+"""
+Local intent routing: decide before any network call whether a query is a
+control command, something native 小爱 already handles, or a question for
+the LLM
+"""
+import collections
+import json
+import logging
+import math
+import random
+import sys
+
+from answercache import normalize
+
+_LOGGER = logging.getLogger(__package__)
+
+INTENT_COMMAND = "command"
+INTENT_NATIVE = "native"
+INTENT_LLM = "llm"
+
+# 原run_forever里的startswith判断
+DEFAULT_COMMANDS = {
+    "闭嘴": "stop",
+    "停止": "stop",
+    "打开高级对话": "enable_llm",
+    "开启高级对话": "enable_llm",
+    "关闭高级对话": "disable_llm",
+}
+
+Route = collections.namedtuple("Route", "intent command score")
+
+
+class CommandTrie:
+    """
+    Character trie of command prefixes, matched against the start of a query
+    """
+
+    _END = ""  # 单个字符的key不会是空串
+
+    def __init__(self, commands=None):
+        self.root = {}
+        for prefix, command in (commands or {}).items():
+            self.add(prefix, command)
+
+    def add(self, prefix, command):
+        node = self.root
+        for char in normalize(prefix):
+            node = node.setdefault(char, {})
+        node[self._END] = command
+
+    def match(self, text):
+        """
+        Return the command of the longest prefix of text, or None
+        """
+        node = self.root
+        command = node.get(self._END)
+        for char in text:
+            node = node.get(char)
+            if node is None:
+                break
+            command = node.get(self._END, command)
+        return command
+
+
+class IntentModel:
+    """
+    TF-IDF over character n-grams followed by one linear (SVM) scorer per
+    class. Weights come from a JSON model file written by ``save``; idf and
+    weights are merged into one table so scoring is one lookup per n-gram.
+    """
+
+    def __init__(self, classes, idf, coef, intercept, ngram_range=(1, 2)):
+        self.classes = list(classes)
+        self.ngram_range = tuple(ngram_range)
+        self.idf = idf
+        self.coef = coef
+        self.intercept = list(intercept)
+        # term -> (idf, 每个类别的权重)
+        self._table = {
+            term: (idf[term], coef.get(term) or [0.0] * len(self.classes))
+            for term in idf
+        }
+
+    def ngrams(self, text):
+        low, high = self.ngram_range
+        counts = collections.Counter()
+        for n in range(low, high + 1):
+            for i in range(len(text) - n + 1):
+                counts[text[i:i + n]] += 1
+        return counts
+
+    def _features(self, text):
+        table = self._table
+        features = []
+        norm = 0.0
+        for term, count in self.ngrams(text).items():
+            entry = table.get(term)
+            if entry is None:
+                continue
+            value = count * entry[0]
+            features.append((value, entry[1]))
+            norm += value * value
+        return features, math.sqrt(norm) or 1.0
+
+    def decision_function(self, text):
+        features, norm = self._features(text)
+        scores = list(self.intercept)
+        for value, weights in features:
+            value /= norm
+            for k, weight in enumerate(weights):
+                scores[k] += value * weight
+        return scores
+
+    def predict(self, text):
+        """
+        Return (class, score) of the highest scoring class
+        """
+        scores = self.decision_function(text)
+        best = max(range(len(scores)), key=scores.__getitem__)
+        return self.classes[best], scores[best]
+
+    @classmethod
+    def fit(cls, samples, ngram_range=(1, 2), epochs=20, alpha=1e-4, seed=0):
+        """
+        Train on (text, label) pairs with one-vs-rest hinge loss SGD
+        """
+        samples = [(normalize(text), label) for text, label in samples]
+        classes = sorted({label for _, label in samples})
+        model = cls(classes, {}, {}, [0.0] * len(classes), ngram_range)
+        df = collections.Counter()
+        for text, _ in samples:
+            df.update(model.ngrams(text).keys())
+        total = len(samples)
+        # 与sklearn的smooth_idf一致
+        idf = {term: math.log((1 + total) / (1 + n)) + 1 for term, n in df.items()}
+        model = cls(classes, idf, {}, [0.0] * len(classes), ngram_range)
+        vectors = []
+        for text, label in samples:
+            features = {term: count * idf[term] for term, count in model.ngrams(text).items()}
+            norm = math.sqrt(sum(v * v for v in features.values())) or 1.0
+            vectors.append(({t: v / norm for t, v in features.items()}, classes.index(label)))
+        coef = collections.defaultdict(lambda: [0.0] * len(classes))
+        intercept = [0.0] * len(classes)
+        rng = random.Random(seed)
+        step = 0
+        for _ in range(epochs):
+            rng.shuffle(vectors)
+            for features, target in vectors:
+                step += 1
+                rate = 1.0 / (alpha * (step + 1000))
+                for k in range(len(classes)):
+                    y = 1.0 if k == target else -1.0
+                    margin = intercept[k] + sum(v * coef[t][k] for t, v in features.items())
+                    shrink = 1.0 - rate * alpha
+                    for t in features:
+                        coef[t][k] *= shrink
+                    if y * margin < 1:
+                        for t, v in features.items():
+                            coef[t][k] += rate * y * v
+                        intercept[k] += rate * y * 0.01
+        return cls(classes, idf, dict(coef), intercept, ngram_range)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            model = json.load(f)
+        return cls(
+            model["classes"],
+            model["idf"],
+            model["coef"],
+            model["intercept"],
+            model.get("ngram_range", (1, 2)),
+        )
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "classes": self.classes,
+                    "ngram_range": list(self.ngram_range),
+                    "idf": self.idf,
+                    "coef": self.coef,
+                    "intercept": self.intercept,
+                },
+                f,
+                ensure_ascii=False,
+            )
+
+
+class IntentRouter:
+    """
+    Route a query to a control command, native 小爱 or the LLM.
+
+    Commands are matched exactly by prefix. Everything else goes to the
+    classifier, any object with ``predict(text) -> (label, score)`` whose
+    labels are INTENT_NATIVE / INTENT_LLM. Without a classifier, or when it
+    is less sure than ``threshold``, the query goes to the LLM as before.
+    """
+
+    def __init__(self, commands=None, classifier=None, threshold=0.0):
+        self.commands = CommandTrie(DEFAULT_COMMANDS if commands is None else commands)
+        self.classifier = classifier
+        self.threshold = threshold
+
+    @classmethod
+    def from_model_file(cls, path=None, **kwargs):
+        classifier = None
+        if path:
+            try:
+                classifier = IntentModel.load(path)
+            except (OSError, ValueError, KeyError):
+                _LOGGER.exception("Exception on load intent model from %s", path)
+        return cls(classifier=classifier, **kwargs)
+
+    def route(self, query):
+        text = normalize(query)
+        command = self.commands.match(text)
+        if command is not None:
+            return Route(INTENT_COMMAND, command, None)
+        if self.classifier is None:
+            return Route(INTENT_LLM, None, None)
+        label, score = self.classifier.predict(text)
+        if label == INTENT_NATIVE and score >= self.threshold:
+            return Route(INTENT_NATIVE, None, score)
+        return Route(INTENT_LLM, None, score)
+
+
+if __name__ == "__main__":
+    # python router.py samples.tsv model.json，samples.tsv每行为"标签\t问题"
+    with open(sys.argv[1], encoding="utf-8") as f:
+        rows = [line.rstrip("\n").split("\t", 1) for line in f if "\t" in line]
+    IntentModel.fit([(text, label) for label, text in rows]).save(sys.argv[2])
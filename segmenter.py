@@ -0,0 +1,65 @@
+"""
+Incremental sentence segmenter for streamed answers
+"""
+
+SOFT_MARKS = "，,"  # 短句（逗号）
+HARD_MARKS = "。？！；.?!;"  # 完整句子
+
+
+class SentenceSegmenter:
+    """
+    Split streamed deltas into speakable chunks.
+
+    The first chunks are cut at any punctuation so the speaker starts talking
+    as early as possible; once ``wait_times`` marks have been spoken only full
+    sentences are emitted. Every character is scanned exactly once.
+    """
+
+    def __init__(self, wait_times=3, soft_marks=SOFT_MARKS, hard_marks=HARD_MARKS):
+        self.wait_times = wait_times
+        self.soft_marks = frozenset(soft_marks)
+        self.hard_marks = frozenset(hard_marks)
+        self.all_marks = self.soft_marks | self.hard_marks
+        self.reset()
+
+    def reset(self):
+        self.commas = 0  # 已经说出的标点数（加上句组数）
+        self._buffer = ""
+        self._marks = 0  # buffer中的标点数
+
+    @property
+    def pending(self):
+        return self._buffer
+
+    def feed(self, delta):
+        """
+        Add a delta and return the longest speakable chunk, or None
+        """
+        start = len(self._buffer)
+        self._buffer += delta
+        breaks = self.all_marks if self.commas <= self.wait_times else self.hard_marks
+        cut = -1
+        marks_at_cut = 0
+        marks = self._marks
+        for i in range(start, len(self._buffer)):
+            ch = self._buffer[i]
+            if ch in self.all_marks:
+                marks += 1
+                if ch in breaks:
+                    cut = i + 1
+                    marks_at_cut = marks
+        self._marks = marks
+        if cut == -1:
+            return None
+        chunk, self._buffer = self._buffer[:cut], self._buffer[cut:]
+        self._marks -= marks_at_cut
+        if self.commas <= self.wait_times:
+            self.commas += marks_at_cut + 1
+        return chunk
+
+    def flush(self):
+        """
+        Return whatever is left at the end of the stream, or None
+        """
+        chunk, self._buffer, self._marks = self._buffer, "", 0
+        return chunk if chunk.strip() else None
@@ -0,0 +1,129 @@
+"""
+Incremental parser for chat completion event streams
+"""
+import json
+
+DONE = b"[DONE]"
+
+
+class SSEParser:
+    """
+    Turn raw text/event-stream bytes into event payloads.
+
+    Chunks can split lines and events anywhere, and lines may end with LF,
+    CRLF or a lone CR. Multi-line ``data:`` fields are joined with newlines,
+    comments and other fields are skipped.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, chunk):
+        """
+        Add received bytes, return the payloads of the events they complete
+        """
+        buffer = self._buffer
+        buffer += chunk
+        if b"\r" in buffer:
+            # 结尾的\r可能是\r\n的前一半，等后面的字节到了再处理
+            keep = 1 if buffer.endswith(b"\r") else 0
+            body = bytes(buffer[:len(buffer) - keep])
+            buffer[:] = body.replace(b"\r\n", b"\n").replace(b"\r", b"\n") + b"\r" * keep
+        end = buffer.rfind(b"\n\n")
+        if end == -1:
+            return []
+        blocks = bytes(buffer[:end]).split(b"\n\n")
+        del buffer[:end + 2]
+        events = []
+        for block in blocks:
+            # 绝大多数事件只有一行"data: ..."
+            if block.startswith(b"data: ") and b"\n" not in block:
+                events.append(block[6:])
+                continue
+            data = []
+            for line in block.split(b"\n"):
+                if line.startswith(b"data:"):
+                    value = line[5:]
+                    data.append(value[1:] if value.startswith(b" ") else value)
+                # ":"开头的注释以及event/id/retry字段都不需要
+            if data:
+                events.append(b"\n".join(data))
+        return events
+
+    def close(self):
+        """
+        Return the last event if the stream ended without a blank line
+        """
+        if self._buffer.strip():
+            return self.feed(b"\n\n")
+        return []
+
+
+class DeltaBuffer:
+    """
+    Accumulate content deltas in a list, joined once when needed
+    """
+
+    def __init__(self):
+        self._parts = []
+        self._length = 0
+
+    def append(self, content):
+        self._parts.append(content)
+        self._length += len(content)
+
+    def getvalue(self):
+        if len(self._parts) > 1:
+            self._parts = ["".join(self._parts)]
+        return self._parts[0] if self._parts else ""
+
+    def __len__(self):
+        return self._length
+
+
+def parse_delta(payload):
+    """
+    Return the delta dict of a chat completion chunk, None for [DONE] and {} for chunks without one
+    """
+    if payload.strip() == DONE:
+        return None
+    choices = json.loads(payload).get("choices")
+    if not choices:
+        return {}
+    return choices[0].get("delta") or {}
+
+
+def iter_deltas(chunks):
+    """
+    Yield the deltas of a stream given as an iterable of byte chunks
+    """
+    parser = SSEParser()
+    for chunk in chunks:
+        for payload in parser.feed(chunk):
+            delta = parse_delta(payload)
+            if delta is None:
+                return
+            yield delta
+    for payload in parser.close():
+        delta = parse_delta(payload)
+        if delta is None:
+            return
+        yield delta
+
+
+async def aiter_deltas(chunks):
+    """
+    Same as iter_deltas for an async iterable, e.g. aiohttp's content.iter_any()
+    """
+    parser = SSEParser()
+    async for chunk in chunks:
+        for payload in parser.feed(chunk):
+            delta = parse_delta(payload)
+            if delta is None:
+                return
+            yield delta
+    for payload in parser.close():
+        delta = parse_delta(payload)
+        if delta is None:
+            return
+        yield delta
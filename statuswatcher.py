@@ -0,0 +1,139 @@
+import asyncio
+import json
+import logging
+import time
+
+from minaservice import MiNAService
+
+_LOGGER = logging.getLogger(__package__)
+
+
+def parse_is_playing(playing_info):
+    # WTF xiaomi api
+    return (
+        json.loads(playing_info.get("data", {}).get("info", "{}")).get("status", -1)
+        == 1
+    )
+
+
+class StatusWatcher:
+    """
+    Poll player_get_status for one device in the background.
+
+    Polls fast while a caller marked the device active (an answer is being
+    spoken) and slowly otherwise, so music or other playback does not keep
+    it busy. Concurrent status requests share one in-flight call, and state
+    changes are published to subscribers.
+    """
+
+    def __init__(
+        self,
+        mina_service: MiNAService,
+        device_id,
+        fast_interval=0.1,
+        slow_interval=2.0,
+    ):
+        self.mina_service = mina_service
+        self.device_id = device_id
+        self.fast_interval = fast_interval
+        self.slow_interval = slow_interval
+        self.is_playing = None  # None: unknown
+        self.updated_at = 0
+        self._active = 0
+        self._inflight = None
+        self._task = None
+        self._wakeup = asyncio.Event()
+        self._idle = asyncio.Event()
+        self._subscribers = set()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def subscribe(self):
+        queue = asyncio.Queue()
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue):
+        self._subscribers.discard(queue)
+
+    def set_active(self, active=True):
+        """
+        Mark the device as speaking (or about to) so polling runs fast
+        """
+        self._active += 1 if active else -1
+        self._wakeup.set()
+
+    async def refresh(self):
+        """
+        Fetch the status now, joining a request that is already in flight
+        """
+        if self._inflight is None:
+            self._inflight = asyncio.ensure_future(self._fetch())
+        return await asyncio.shield(self._inflight)
+
+    async def get_is_playing(self, max_age=None):
+        """
+        Return the cached status if younger than max_age seconds, else refresh
+        """
+        if (
+            max_age is not None
+            and self.is_playing is not None
+            and time.monotonic() - self.updated_at <= max_age
+        ):
+            return self.is_playing
+        return await self.refresh()
+
+    async def wait_until_idle(self):
+        if self.is_playing is None:
+            await self.refresh()
+        await self._idle.wait()
+
+    async def _fetch(self):
+        try:
+            playing_info = await self.mina_service.player_get_status(self.device_id)
+            self._publish(parse_is_playing(playing_info))
+            return self.is_playing
+        finally:
+            self._inflight = None
+
+    def _publish(self, is_playing):
+        self.updated_at = time.monotonic()
+        if is_playing == self.is_playing:
+            return
+        self.is_playing = is_playing
+        if is_playing:
+            self._idle.clear()
+        else:
+            self._idle.set()
+        for queue in self._subscribers:
+            queue.put_nowait(is_playing)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.refresh()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                _LOGGER.warning("Get status of %s failed: %s", self.device_id, e)
+            fast = self._active > 0
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(
+                    self._wakeup.wait(),
+                    self.fast_interval if fast else self.slow_interval,
+                )
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Run several MiGPT speakers in one process.
+
+    python supervisor.py devices.json
+
+devices.json:
+    {
+        "openai_api_key": "sk-...",
+        "metrics_port": 9105,
+        "trace_file": "migpt-trace.jsonl",
+        "answer_cache": "migpt-answers.json",
+        "intent_model": "intent-model.json",
+        "accounts": {"小米账号": "密码"},
+        "devices": [
+            {"mi_user": "小米账号", "hardware": "LX06", "device_name": "客厅音箱"},
+            {"mi_user": "小米账号", "hardware": "L17A", "use_command": false}
+        ]
+    }
+"""
+import asyncio
+import json
+import logging
+import sys
+
+from httppool import PoolStats, create_session
+from miaccount import MiAccount
+from deviceregistry import DeviceRegistry
+from minaservice import MiNAService
+from MIGPT import MiGPT, check_config, get_devices_path, get_token_path
+from answercache import AnswerCache
+from commandtts import CommandTTS
+from router import IntentRouter
+from tracing import Tracer
+
+_LOGGER = logging.getLogger(__package__)
+
+
+class Supervisor:
+    """
+    Run one MiGPT loop per device as asyncio tasks.
+
+    All devices share one pooled ClientSession, devices on the same Xiaomi account
+    share one MiAccount, and the tokenizer is shared through V3.get_encoding.
+    Each device keeps its own conversation and switch state; a crashed device
+    is restarted with backoff without touching the others.
+    """
+
+    def __init__(
+        self,
+        restart_delay=5,
+        max_restart_delay=300,
+        trace_file=None,
+        metrics_port=None,
+        answer_cache=None,
+        intent_model=None,
+    ):
+        self.restart_delay = restart_delay
+        self.max_restart_delay = max_restart_delay
+        self.passwords = {}
+        self.device_configs = []
+        self.accounts = {}
+        self.registries = {}
+        self.devices = []
+        self.pool_stats = PoolStats()
+        self.tracer = Tracer(trace_file)  # 所有音箱共用，按型号区分
+        self.metrics_port = metrics_port
+        # 所有音箱共用一个回答缓存
+        self.answer_cache = AnswerCache(answer_cache) if answer_cache else None
+        self.router = IntentRouter.from_model_file(intent_model)
+
+    def add_account(self, mi_user, mi_pass):
+        self.passwords[mi_user] = mi_pass
+
+    def add_device(self, mi_user, hardware, api_key=None, **kwargs):
+        check_config(mi_user, self.passwords.get(mi_user), api_key, hardware)
+        self.device_configs.append(
+            dict(mi_user=mi_user, hardware=hardware, api_key=api_key, **kwargs)
+        )
+
+    def get_account(self, session, mi_user):
+        if mi_user not in self.accounts:
+            self.accounts[mi_user] = MiAccount(
+                session,
+                mi_user,
+                self.passwords[mi_user],
+                get_token_path(mi_user),
+            )
+        return self.accounts[mi_user]
+
+    def get_registry(self, session, mi_user):
+        if mi_user not in self.registries:
+            self.registries[mi_user] = DeviceRegistry(
+                MiNAService(self.get_account(session, mi_user)),
+                get_devices_path(mi_user),
+            )
+        return self.registries[mi_user]
+
+    async def _run_device(self, miboy, session):
+        delay = self.restart_delay
+        while True:
+            try:
+                await miboy.run_forever(session)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                _LOGGER.exception(
+                    "MiGPT on %s (%s) crashed, restart in %ss",
+                    miboy.hardware, miboy.mi_user, delay,
+                )
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_restart_delay)
+
+    async def run_forever(self):
+        # 使用micli的音箱共用一个并发上限
+        command_tts = CommandTTS()
+        async with create_session(stats=self.pool_stats) as session:
+            for config in self.device_configs:
+                mi_user = config["mi_user"]
+                self.devices.append(
+                    MiGPT(
+                        mi_pass=self.passwords[mi_user],
+                        account=self.get_account(session, mi_user),
+                        device_registry=self.get_registry(session, mi_user),
+                        tracer=self.tracer,
+                        answer_cache=self.answer_cache,
+                        router=self.router,
+                        command_tts=command_tts,
+                        **config,
+                    )
+                )
+            if self.metrics_port:
+                await self.tracer.serve(port=self.metrics_port)
+            await asyncio.gather(
+                *(self._run_device(miboy, session) for miboy in self.devices)
+            )
+
+    @classmethod
+    def from_config(cls, file):
+        with open(file, encoding="utf-8") as f:
+            config = json.load(f)
+        supervisor = cls(
+            trace_file=config.get("trace_file"),
+            metrics_port=config.get("metrics_port"),
+            answer_cache=config.get("answer_cache"),
+            intent_model=config.get("intent_model"),
+        )
+        for mi_user, mi_pass in config.get("accounts", {}).items():
+            supervisor.add_account(mi_user, mi_pass)
+        for device in config.get("devices", []):
+            device = dict(device)
+            device.setdefault("api_key", config.get("openai_api_key"))
+            supervisor.add_device(**device)
+        return supervisor
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(Supervisor.from_config(sys.argv[1]).run_forever())
@@ -0,0 +1,53 @@
+import asyncio
+
+
+class TaskGroup:
+    """
+    Minimal structured task group, like asyncio.TaskGroup (Python 3.11+).
+
+    Leaving the ``async with`` block cancels every task still running and
+    waits for all of them. The first task that fails cancels the others and
+    the block itself, and its exception is raised from the block.
+    """
+
+    def __init__(self):
+        self._tasks = set()
+        self._parent = None
+        self._error = None
+        self._exiting = False
+        self._parent_cancelled = False
+
+    async def __aenter__(self):
+        self._parent = asyncio.current_task()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        self._exiting = True
+        self.cancel()
+        if self._tasks:
+            await asyncio.wait(self._tasks)
+        if self._parent_cancelled and hasattr(self._parent, "uncancel"):
+            # 3.11+：撤销我们自己发出的取消请求
+            self._parent.uncancel()
+        if self._error is not None:
+            raise self._error
+        return False
+
+    def create_task(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._on_done)
+        return task
+
+    def cancel(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def _on_done(self, task):
+        if task.cancelled() or task.exception() is None or self._error is not None:
+            return
+        self._error = task.exception()
+        self.cancel()
+        if not self._exiting:
+            self._parent_cancelled = True
+            self._parent.cancel()
@@ -0,0 +1,116 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dispatcher import (  # noqa: E402
+    PRIORITY_HIGH,
+    PRIORITY_LOW,
+    PRIORITY_NORMAL,
+    Dispatcher,
+    TokenBucket,
+)
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    assert bucket.try_take() and bucket.try_take()
+    assert not bucket.try_take()
+    assert 0 < bucket.delay() <= 0.1
+
+
+def test_burst_then_priority_order():
+    order = []
+
+    async def main():
+        dispatcher = Dispatcher(rate=50, burst=1)
+        await dispatcher.acquire()  # 用掉唯一的令牌，之后的都要排队
+
+        async def send(name, priority):
+            await dispatcher.acquire(priority)
+            order.append(name)
+
+        await asyncio.gather(
+            send("poll-1", PRIORITY_LOW),
+            send("other", PRIORITY_NORMAL),
+            send("poll-2", PRIORITY_LOW),
+            send("tts", PRIORITY_HIGH),
+        )
+        assert dispatcher.delayed == 4
+
+    asyncio.run(main())
+    assert order == ["tts", "other", "poll-1", "poll-2"]
+
+
+def test_rate_is_enforced():
+    async def main():
+        dispatcher = Dispatcher(rate=100, burst=1)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(6):
+            await dispatcher.acquire()
+        return loop.time() - start
+
+    assert asyncio.run(main()) >= 0.04
+
+
+def test_cancelled_waiter_is_skipped():
+    async def main():
+        dispatcher = Dispatcher(rate=50, burst=1)
+        await dispatcher.acquire()
+        cancelled = asyncio.ensure_future(dispatcher.acquire(PRIORITY_HIGH))
+        await asyncio.sleep(0)
+        cancelled.cancel()
+        await asyncio.wait_for(dispatcher.acquire(PRIORITY_LOW), 1)
+
+    asyncio.run(main())
+
+
+def test_singleflight():
+    calls = []
+
+    async def main():
+        dispatcher = Dispatcher()
+
+        async def request():
+            calls.append(None)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(
+            *(dispatcher.submit(request, key="status") for _ in range(3)),
+            dispatcher.submit(request, key="other"),
+        )
+        assert results == [2, 2, 2, 2]
+        assert dispatcher.deduplicated == 2
+        # 完成后同一个key重新发出
+        assert await dispatcher.submit(request, key="status") == 3
+        # 没有key的请求不合并
+        await asyncio.gather(dispatcher.submit(request), dispatcher.submit(request))
+
+    asyncio.run(main())
+    assert len(calls) == 5
+
+
+def test_singleflight_error_and_cancel():
+    async def main():
+        dispatcher = Dispatcher()
+        started = asyncio.Event()
+
+        async def request():
+            started.set()
+            await asyncio.sleep(0.02)
+            raise ValueError("boom")
+
+        first = asyncio.ensure_future(dispatcher.submit(request, key="k"))
+        await started.wait()
+        second = asyncio.ensure_future(dispatcher.submit(request, key="k"))
+        await asyncio.sleep(0)
+        first.cancel()  # 一个调用者被取消，另一个仍然拿到结果
+        with pytest.raises(ValueError):
+            await second
+
+    asyncio.run(main())
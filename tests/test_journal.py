@@ -0,0 +1,104 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from journal import ConversationJournal  # noqa: E402
+
+
+def records(journal, convo_id):
+    with open(journal._path(convo_id), encoding="utf-8") as f:
+        return f.read().splitlines()
+
+
+def test_replay_append_pop_replace(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.append("a", "system", "prompt")
+    journal.append("a", "user", "问题")
+    journal.append("a", "assistant", "回答")
+    journal.pop("a", 1)
+    journal.close()
+    assert ConversationJournal(str(tmp_path)).load("a") == [
+        ("system", "prompt"),
+        ("assistant", "回答"),
+    ]
+
+    journal = ConversationJournal(str(tmp_path))
+    journal.replace("a", [("system", "new", 12)])
+    journal.append("a", "user", "q")
+    journal.close()
+    assert ConversationJournal(str(tmp_path)).load("a") == [("system", "new"), ("user", "q")]
+
+
+def test_unknown_conversation(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    assert journal.load("missing") is None
+    assert journal.mtime("missing") is None
+
+
+def test_convo_id_is_quoted(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.append("../x/y", "user", "q")
+    journal.close()
+    assert os.listdir(tmp_path) == ["..%2Fx%2Fy.jsonl"]
+    assert journal.load("../x/y") == [("user", "q")]
+
+
+def test_torn_last_line_is_skipped(tmp_path):
+    journal = ConversationJournal(str(tmp_path))
+    journal.append("a", "user", "q")
+    journal.append("a", "assistant", "ans")
+    journal.close()
+    with open(journal._path("a"), "a", encoding="utf-8") as f:
+        f.write('{"a":["user","cut')  # 崩溃时写了一半
+    assert ConversationJournal(str(tmp_path)).load("a") == [("user", "q"), ("assistant", "ans")]
+
+
+def test_compaction(tmp_path):
+    journal = ConversationJournal(str(tmp_path), compact_ratio=1)
+    messages = []
+    for i in range(10):
+        messages.append(("user", str(i)))
+        journal.append("a", "user", str(i))
+    assert not journal.maybe_compact("a", messages)
+    journal.pop("a", 0)
+    messages.pop(0)
+    assert journal.maybe_compact("a", messages)
+    assert len(records(journal, "a")) == 1
+    journal.append("a", "user", "10")
+    journal.close()
+    assert ConversationJournal(str(tmp_path)).load("a") == messages + [("user", "10")]
+    assert not os.path.exists(journal._path("a") + ".tmp")
+
+
+def test_sync_without_loop(tmp_path, monkeypatch):
+    synced = []
+    monkeypatch.setattr(os, "fsync", synced.append)
+    journal = ConversationJournal(str(tmp_path))
+    journal.append("a", "user", "q")
+    assert len(synced) == 1
+    assert journal._unsynced == 0
+
+
+def test_deferred_sync_on_loop(tmp_path, monkeypatch):
+    synced = []
+    real_fsync = os.fsync
+    monkeypatch.setattr(os, "fsync", lambda fd: synced.append(fd) or real_fsync(fd))
+
+    async def main():
+        journal = ConversationJournal(str(tmp_path), fsync_every=3, fsync_interval=0.05)
+        journal.append("a", "user", "q")
+        journal.append("a", "assistant", "ans")
+        assert synced == []  # 不在事件循环里fsync
+        await asyncio.sleep(0.2)
+        assert len(synced) == 1
+        assert journal._unsynced == 0
+        journal.fsync_interval = 60
+        for i in range(3):
+            journal.append("a", "user", str(i))
+        await asyncio.sleep(0.1)  # 攒够fsync_every条，不等fsync_interval
+        assert len(synced) == 2
+        journal.close()
+
+    asyncio.run(main())
@@ -0,0 +1,148 @@
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from llmpool import Backend, BackendPool  # noqa: E402
+
+
+class FakeContent:
+    def __init__(self, chunks, first_delay):
+        self.chunks = chunks
+        self.first_delay = first_delay
+
+    async def iter_any(self):
+        await asyncio.sleep(self.first_delay)
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeResponse:
+    """
+    Just enough of an aiohttp response for BackendPool
+    """
+
+    def __init__(self, text, first_delay=0.0, status=200):
+        self.status = status
+        self.reason = "Bad Gateway" if status != 200 else "OK"
+        chunks = [b'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n']
+        for char in text:
+            delta = json.dumps({"choices": [{"delta": {"content": char}}]})
+            chunks.append(b"data: " + delta.encode() + b"\n\n")
+        chunks.append(b"data: [DONE]\n\n")
+        self.content = FakeContent(chunks, first_delay)
+        self.closed = False
+        self.released = False
+
+    async def text(self):
+        return "error"
+
+    def close(self):
+        self.closed = True
+
+    def release(self):
+        self.released = True
+
+
+def opener(responses):
+    """
+    open_stream for BackendPool.stream: backend name -> FakeResponse or exception
+    """
+    opened = {}
+
+    async def open_stream(backend):
+        response = responses[backend.name]
+        opened[backend.name] = response
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    return open_stream, opened
+
+
+async def collect(pool, open_stream):
+    return "".join([d.get("content", "") async for d in pool.stream(open_stream)])
+
+
+def test_single_backend():
+    pool = BackendPool([Backend(name="a")])
+    open_stream, opened = opener({"a": FakeResponse("你好")})
+    assert asyncio.run(collect(pool, open_stream)) == "你好"
+    assert opened["a"].released and not opened["a"].closed
+    assert pool.backends[0].wins == 1
+    assert pool.backends[0].ttft is not None
+
+
+@pytest.mark.parametrize("failure", [ConnectionError("refused"), FakeResponse("", status=502)])
+def test_failover(failure):
+    a, b = Backend(name="a"), Backend(name="b")
+    pool = BackendPool([a, b])
+    open_stream, opened = opener({"a": failure, "b": FakeResponse("ok")})
+    assert asyncio.run(collect(pool, open_stream)) == "ok"
+    assert a.failures == 1 and b.wins == 1
+
+
+def test_all_backends_fail():
+    pool = BackendPool([Backend(name="a"), Backend(name="b")])
+    open_stream, _ = opener({"a": ConnectionError("a"), "b": ConnectionError("b")})
+    with pytest.raises(ConnectionError, match="b"):
+        asyncio.run(collect(pool, open_stream))
+
+
+def test_unhealthy_backend_tried_last():
+    a, b = Backend(name="a"), Backend(name="b")
+    pool = BackendPool([a, b], failure_threshold=2, cooldown=60)
+    a.record_failure(2, 60)
+    assert pool.candidates() == [a, b]
+    a.record_failure(2, 60)
+    assert pool.candidates() == [b, a]
+    a.record_success(0.1)
+    assert pool.candidates() == [a, b]
+
+
+def test_hedge_to_faster_backend():
+    slow, fast = Backend(name="slow"), Backend(name="fast")
+    pool = BackendPool([slow, fast], hedge_delay=0.02)
+    open_stream, opened = opener({
+        "slow": FakeResponse("慢", first_delay=1),
+        "fast": FakeResponse("快", first_delay=0.01),
+    })
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        text = await collect(pool, open_stream)
+        await asyncio.sleep(0)  # 让被取消的请求完成清理
+        return text, loop.time() - start
+
+    text, elapsed = asyncio.run(main())
+    assert text == "快"
+    assert elapsed < 0.5
+    assert fast.wins == 1 and slow.wins == 0
+    assert slow.failures == 0  # 输掉的请求不算失败
+
+
+def test_no_hedge_when_first_is_fast():
+    pool = BackendPool([Backend(name="a"), Backend(name="b")], hedge_delay=0.2)
+    open_stream, opened = opener({"a": FakeResponse("a"), "b": FakeResponse("b")})
+    assert asyncio.run(collect(pool, open_stream)) == "a"
+    assert list(opened) == ["a"]
+
+
+def test_consumer_stops_early_closes_response():
+    pool = BackendPool([Backend(name="a")])
+    open_stream, opened = opener({"a": FakeResponse("abcdef")})
+
+    async def main():
+        stream = pool.stream(open_stream)
+        async for delta in stream:
+            if "content" in delta:
+                break
+        await stream.aclose()
+
+    asyncio.run(main())
+    assert opened["a"].closed
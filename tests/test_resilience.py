@@ -0,0 +1,168 @@
+import asyncio
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from resilience import (  # noqa: E402
+    CircuitBreaker,
+    CircuitOpenError,
+    MiAuthError,
+    MiNetworkError,
+    MiRequestError,
+    MiThrottleError,
+    RequestPolicy,
+    classify_response,
+    hedge,
+)
+
+
+def failing(*errors, result="ok"):
+    """
+    A request that raises errors in order, then returns result
+    """
+    calls = []
+
+    async def request():
+        calls.append(time.monotonic())
+        if len(calls) <= len(errors):
+            raise errors[len(calls) - 1]
+        return result
+
+    return request, calls
+
+
+def call(policy, request, **kwargs):
+    return asyncio.run(policy.call("/remote/ubus", request, **kwargs))
+
+
+@pytest.mark.parametrize(
+    "status, resp, error",
+    [
+        (401, "", MiAuthError),
+        (200, {"code": 3, "message": "auth failed"}, MiAuthError),
+        (429, "", MiThrottleError),
+        (200, {"code": 1, "message": "Too many requests"}, MiThrottleError),
+        (502, "<html>", MiNetworkError),
+        (200, {"code": 101, "message": "bad param"}, MiRequestError),
+    ],
+)
+def test_classify_response(status, resp, error):
+    assert classify_response(status, resp) is error
+
+
+def test_retry_transient_then_succeed():
+    policy = RequestPolicy(base_delay=0.001)
+    request, calls = failing(MiNetworkError("reset"), MiThrottleError("slow down"))
+    assert call(policy, request) == "ok"
+    assert len(calls) == 3
+    assert policy.errors == {"network": 1, "throttle": 1}
+
+
+def test_give_up_after_attempts():
+    policy = RequestPolicy(attempts=2, base_delay=0.001)
+    request, calls = failing(*[MiNetworkError("down")] * 3)
+    with pytest.raises(MiNetworkError):
+        call(policy, request)
+    assert len(calls) == 2
+
+
+@pytest.mark.parametrize("error", [MiRequestError("bad"), MiAuthError("token")])
+def test_permanent_errors_not_retried(error):
+    policy = RequestPolicy(base_delay=0.001)
+    request, calls = failing(error)
+    with pytest.raises(type(error)):
+        call(policy, request)
+    assert len(calls) == 1
+
+
+@pytest.mark.parametrize(
+    "error, attempts",
+    [
+        (MiNetworkError("timeout"), 1),  # 可能已经发出
+        (MiNetworkError("refused", maybe_sent=False), 2),
+        (MiThrottleError("slow down"), 2),
+    ],
+)
+def test_non_idempotent_retried_only_if_not_sent(error, attempts):
+    policy = RequestPolicy(base_delay=0.001)
+    request, calls = failing(error)
+    if attempts == 1:
+        with pytest.raises(type(error)):
+            call(policy, request, idempotent=False)
+    else:
+        assert call(policy, request, idempotent=False) == "ok"
+    assert len(calls) == attempts
+
+
+def test_policy_opens_breaker_per_endpoint():
+    policy = RequestPolicy(attempts=1, failure_threshold=2)
+
+    async def main():
+        request, _ = failing(*[MiNetworkError("down")] * 10)
+        for _ in range(2):
+            with pytest.raises(MiNetworkError):
+                await policy.call("status", request)
+        with pytest.raises(CircuitOpenError):
+            await policy.call("status", request)
+        # 其他endpoint不受影响
+        ok, _ = failing()
+        assert await policy.call("tts", ok) == "ok"
+
+    asyncio.run(main())
+    assert policy.errors["circuit_open"] == 1
+
+
+def test_throttling_does_not_open_breaker():
+    policy = RequestPolicy(attempts=1, failure_threshold=2)
+
+    async def main():
+        request, _ = failing(*[MiThrottleError("slow down")] * 3)
+        for _ in range(3):
+            with pytest.raises(MiThrottleError):
+                await policy.call("status", request)
+
+    asyncio.run(main())
+    assert policy.breaker("status").state == "closed"
+
+
+def test_circuit_breaker_states(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10)
+    assert breaker.state == "closed" and breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.record_failure()
+    assert breaker.state == "open" and not breaker.allow()
+    now[0] += 10
+    assert breaker.state == "half_open"
+    assert breaker.allow()  # 只放行一个试探请求
+    assert not breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    now[0] += 10
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == "closed" and breaker.failures == 0
+
+
+def test_hedge():
+    async def main():
+        started = []
+
+        async def slow_then_fast():
+            started.append(None)
+            await asyncio.sleep(1 if len(started) == 1 else 0.01)
+            return len(started)
+
+        assert await hedge(slow_then_fast, 0.02) == 2  # 第二个请求先返回
+
+        fast, calls = failing()
+        assert await hedge(fast, 0.02) == "ok"
+        assert len(calls) == 1
+
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from bench_segmenter import make_deltas, new_segment, old_segment  # noqa: E402
+from segmenter import SentenceSegmenter  # noqa: E402
+
+
+def feed_all(segmenter, deltas):
+    chunks = []
+    for delta in deltas:
+        chunk = segmenter.feed(delta)
+        if chunk is not None:
+            chunks.append(chunk)
+    return chunks
+
+
+def test_first_chunk_cut_at_comma():
+    segmenter = SentenceSegmenter(wait_times=3)
+    assert segmenter.feed("你好") is None
+    assert segmenter.feed("，今天") == "你好，"
+    assert segmenter.pending == "今天"
+
+
+def test_soft_marks_until_wait_times_then_hard_marks():
+    segmenter = SentenceSegmenter(wait_times=1)
+    assert segmenter.feed("一，") == "一，"
+    # 已经说出一个标点加一个句组，之后只在整句处切分
+    assert segmenter.commas == 2
+    assert segmenter.feed("二，三，") is None
+    assert segmenter.feed("四。五") == "二，三，四。"
+    assert segmenter.pending == "五"
+
+
+def test_cut_at_last_mark_in_delta():
+    segmenter = SentenceSegmenter(wait_times=3)
+    assert segmenter.feed("一，二。三") == "一，二。"
+    assert segmenter.pending == "三"
+    # 两个标点加一个句组
+    assert segmenter.commas == 3
+
+
+def test_delta_split_across_marks():
+    segmenter = SentenceSegmenter(wait_times=0)
+    assert feed_all(segmenter, ["今天天", "气很好", "。明", "天", "也不错", "！"]) == [
+        "今天天气很好。",
+        "明天也不错！",
+    ]
+    assert segmenter.flush() is None
+
+
+@pytest.mark.parametrize("tail", ["", "   ", "\n"])
+def test_flush_whitespace_tail(tail):
+    segmenter = SentenceSegmenter()
+    segmenter.feed("好的。" + tail)
+    assert segmenter.flush() is None
+    assert segmenter.pending == ""
+
+
+def test_flush_tail_without_punctuation():
+    segmenter = SentenceSegmenter()
+    assert segmenter.feed("好的。最后一句") == "好的。"
+    assert segmenter.flush() == "最后一句"
+    assert segmenter.flush() is None
+
+
+def test_configurable_marks():
+    segmenter = SentenceSegmenter(wait_times=0, soft_marks="、", hard_marks="|")
+    assert segmenter.feed("a、b。c|d") == "a、b。c|"
+    assert segmenter.pending == "d"
+
+
+def test_reset():
+    segmenter = SentenceSegmenter(wait_times=0)
+    segmenter.feed("一，二")
+    segmenter.reset()
+    assert segmenter.commas == 0
+    assert segmenter.pending == ""
+    assert segmenter.feed("三，") == "三，"
+
+
+@pytest.mark.parametrize("chars", [1, 50, 400, 2000])
+def test_same_chunks_as_old_segmentation(chars):
+    deltas = make_deltas(chars)
+    assert old_segment(deltas) == new_segment(deltas)
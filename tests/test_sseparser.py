@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sseparser import SSEParser, iter_deltas, parse_delta  # noqa: E402
+
+STREAM = (
+    b'data: {"choices": [{"delta": {"role": "assistant"}}]}\n\n'
+    b'data: {"choices": [{"delta": {"content": "\xe4\xbd\xa0\xe5\xa5\xbd"}}]}\n\n'
+    b": keep-alive\n\n"
+    b'data: {"choices": [{"delta": {"content": "!"}}]}\n\n'
+    b"data: [DONE]\n\n"
+)
+DELTAS = [{"role": "assistant"}, {"content": "你好"}, {"content": "!"}]
+
+
+@pytest.mark.parametrize("newline", [b"\n", b"\r\n", b"\r"])
+@pytest.mark.parametrize("size", [1, 3, 7, len(STREAM)])
+def test_chunks_and_line_endings(newline, size):
+    stream = STREAM.replace(b"\n", newline)
+    chunks = [stream[i:i + size] for i in range(0, len(stream), size)]
+    assert list(iter_deltas(chunks)) == DELTAS
+
+
+def test_lone_cr_does_not_merge_events():
+    parser = SSEParser()
+    assert parser.feed(b"data: 1\r\rdata: 2\r\r") == [b"1"]
+    # 结尾的\r要等到下一个字节才能确定
+    assert parser.feed(b"data: 3\r\r") == [b"2"]
+    assert parser.close() == [b"3"]
+
+
+def test_extra_whitespace_before_payload():
+    assert parse_delta(b' {"choices": [{"delta": {"content": "a"}}]}') == {"content": "a"}
+    assert parse_delta(b" [DONE]") is None
+    assert list(iter_deltas([b'data:  {"choices": [{"delta": {"content": "b"}}]}\n\n'])) == [
+        {"content": "b"}
+    ]
+
+
+def test_multiline_data_and_unterminated_last_event():
+    parser = SSEParser()
+    assert parser.feed(b"event: x\ndata: a\ndata:b\n\ndata: c") == [b"a\nb"]
+    assert parser.close() == [b"c"]
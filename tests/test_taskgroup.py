@@ -0,0 +1,93 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from taskgroup import TaskGroup  # noqa: E402
+
+
+def test_exit_cancels_and_waits_for_tasks():
+    async def main():
+        cleaned = []
+
+        async def forever():
+            try:
+                await asyncio.sleep(10)
+            finally:
+                await asyncio.sleep(0)
+                cleaned.append(True)
+
+        async with TaskGroup() as group:
+            tasks = [group.create_task(forever()) for _ in range(2)]
+            done = group.create_task(asyncio.sleep(0, result="done"))
+            await done
+        assert all(task.cancelled() for task in tasks)
+        assert cleaned == [True, True]
+        assert done.result() == "done"
+
+    asyncio.run(main())
+
+
+def test_first_failure_cancels_siblings_and_body():
+    async def main():
+        body_cancelled = False
+
+        async def fail():
+            await asyncio.sleep(0.01)
+            raise ValueError("boom")
+
+        with pytest.raises(ValueError, match="boom"):
+            async with TaskGroup() as group:
+                sibling = group.create_task(asyncio.sleep(10))
+                group.create_task(fail())
+                try:
+                    await asyncio.sleep(10)
+                except asyncio.CancelledError:
+                    body_cancelled = True
+                    raise
+        assert body_cancelled
+        assert sibling.cancelled()
+        task = asyncio.current_task()
+        if hasattr(task, "cancelling"):
+            # 3.11+：取消计数恢复，之后的await不会被误取消
+            assert task.cancelling() == 0
+        await asyncio.sleep(0)
+
+    asyncio.run(main())
+
+
+def test_only_first_error_is_raised():
+    async def main():
+        async def fail(delay, message):
+            await asyncio.sleep(delay)
+            raise ValueError(message)
+
+        with pytest.raises(ValueError, match="first"):
+            async with TaskGroup() as group:
+                group.create_task(fail(0.01, "first"))
+                group.create_task(fail(0.01, "second"))
+                await asyncio.sleep(10)
+
+    asyncio.run(main())
+
+
+def test_outer_cancel_propagates():
+    async def main():
+        inner = []
+
+        async def run():
+            async with TaskGroup() as group:
+                inner.append(group.create_task(asyncio.sleep(10)))
+                await asyncio.sleep(10)
+
+        task = asyncio.ensure_future(run())
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert inner[0].cancelled()
+
+    asyncio.run(main())
@@ -0,0 +1,151 @@
+import collections
+import contextlib
+import json
+import logging
+import time
+
+_LOGGER = logging.getLogger(__package__)
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """
+    Keep the latest max_samples values for quantiles, plus a running count and sum
+    """
+
+    def __init__(self, max_samples=1024):
+        self.samples = collections.deque(maxlen=max_samples)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.samples.append(value)
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        if not self.samples:
+            return float("nan")
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Turn:
+    """
+    Spans of one question, keyed by the conversation record timestamp
+    """
+
+    def __init__(self, key, device="", **attrs):
+        self.key = key
+        self.device = device
+        self.attrs = attrs
+        self.started = time.time()
+        self.spans = []
+
+    def add_span(self, stage, start, end=None, **attrs):
+        self.spans.append(
+            dict(stage=stage, start=start, end=time.time() if end is None else end, **attrs)
+        )
+
+    def mark(self, stage, **attrs):
+        """
+        Record how long after the turn started a point was reached
+        """
+        self.add_span(stage, self.started, **attrs)
+
+    @contextlib.contextmanager
+    def span(self, stage, **attrs):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add_span(stage, start, **attrs)
+
+    def to_dict(self):
+        return {
+            "key": self.key,
+            "device": self.device,
+            "started": self.started,
+            **self.attrs,
+            "spans": [
+                dict(span, duration=round(span["end"] - span["start"], 4))
+                for span in self.spans
+            ],
+        }
+
+
+class Tracer:
+    """
+    Collect turns, export stage histograms in Prometheus text format and
+    append every finished turn to a JSONL trace file
+    """
+
+    def __init__(self, trace_file=None, max_samples=1024):
+        self.trace_file = trace_file
+        self.max_samples = max_samples
+        self.histograms = {}
+        self.collectors = []  # 其他模块的指标，返回Prometheus文本的函数
+        self._runner = None
+
+    def start_turn(self, key, device="", **attrs):
+        return Turn(key, device, **attrs)
+
+    def finish_turn(self, turn: Turn):
+        turn.add_span("turn", turn.started)
+        for span in turn.spans:
+            histogram = self.histograms.get((turn.device, span["stage"]))
+            if histogram is None:
+                histogram = Histogram(self.max_samples)
+                self.histograms[(turn.device, span["stage"])] = histogram
+            histogram.observe(span["end"] - span["start"])
+        if self.trace_file:
+            try:
+                with open(self.trace_file, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(turn.to_dict(), ensure_ascii=False) + "\n")
+            except OSError:
+                _LOGGER.exception("Exception on write trace to %s", self.trace_file)
+
+    def prometheus_text(self):
+        lines = [
+            "# HELP migpt_stage_seconds Duration of each stage of a turn",
+            "# TYPE migpt_stage_seconds summary",
+        ]
+        for (device, stage), histogram in sorted(self.histograms.items()):
+            labels = f'device="{device}",stage="{stage}"'
+            for q in QUANTILES:
+                lines.append(
+                    f'migpt_stage_seconds{{{labels},quantile="{q}"}} {histogram.quantile(q):.4f}'
+                )
+            lines.append(f"migpt_stage_seconds_sum{{{labels}}} {histogram.sum:.4f}")
+            lines.append(f"migpt_stage_seconds_count{{{labels}}} {histogram.count}")
+        text = "\n".join(lines) + "\n"
+        return text + "".join(collector() for collector in self.collectors)
+
+    def add_collector(self, collector):
+        if collector not in self.collectors:
+            self.collectors.append(collector)
+
+    async def _metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(text=self.prometheus_text(), content_type="text/plain")
+
+    async def serve(self, host="127.0.0.1", port=9105):
+        """
+        Serve /metrics on a local port
+        """
+        if self._runner is not None:
+            return
+        from aiohttp import web  # 只有开启指标时才需要
+
+        app = web.Application()
+        app.router.add_get("/metrics", self._metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
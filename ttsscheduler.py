@@ -0,0 +1,122 @@
+import asyncio
+import logging
+import time
+
+from resilience import MiRequestError
+from statuswatcher import StatusWatcher
+
+_LOGGER = logging.getLogger(__package__)
+
+DEFAULT_CHARS_PER_SECOND = 4.5  # 小爱TTS大约每秒4~5个汉字
+# 每种型号校准后的语速（字/秒），同一进程内的所有音箱共享
+SPEECH_RATES = {}
+
+
+class TTSScheduler:
+    """
+    Queue ready sentences and send each one just before the previous ends.
+
+    The remaining playback time is estimated from the text length and a
+    per-hardware speech rate, which is calibrated whenever a sentence is seen
+    playing to its end. The next text_to_speech is fired ``tts_latency``
+    (measured round trip) before the estimated end, or as soon as the status
+    watcher reports the speaker idle, whichever comes first.
+    """
+
+    def __init__(
+        self,
+        speak,
+        status_watcher: StatusWatcher,
+        hardware,
+        safety_factor=1.1,
+        smoothing=0.3,
+    ):
+        self.speak = speak  # async def speak(text)
+        self.status_watcher = status_watcher
+        self.hardware = hardware
+        self.safety_factor = safety_factor
+        self.smoothing = smoothing
+        self.tts_latency = 0  # 第一次测量前不提前发送
+        self.queue = asyncio.Queue()
+        self._text = None
+        self._started_at = 0
+        self._ends_at = 0
+        self._seen_playing = False
+        self._finished = asyncio.Event()
+        self._finished.set()
+
+    @property
+    def chars_per_second(self):
+        return SPEECH_RATES.get(self.hardware, DEFAULT_CHARS_PER_SECOND)
+
+    def put(self, text):
+        self.queue.put_nowait(text)
+
+    def close(self):
+        self.queue.put_nowait(None)
+
+    async def run(self):
+        """
+        Speak queued sentences until close() and the last one has played
+        """
+        changes = self.status_watcher.subscribe()
+        monitor = asyncio.create_task(self._monitor(changes))
+        try:
+            if self.status_watcher.is_playing is not False:
+                try:
+                    await self.status_watcher.wait_until_idle()
+                except MiRequestError as e:
+                    # 查不到状态时直接开始播报
+                    _LOGGER.warning("Get status of %s failed: %s", self.hardware, e)
+            while True:
+                text = await self.queue.get()
+                if text is None:
+                    break
+                await self._wait_for_slot(self.tts_latency)
+                await self._speak(text)
+            await self._wait_for_slot(0)
+        finally:
+            monitor.cancel()
+            self.status_watcher.unsubscribe(changes)
+
+    async def _wait_for_slot(self, lead):
+        delay = self._ends_at - lead - time.monotonic()
+        if delay <= 0 or self._finished.is_set():
+            return
+        try:
+            await asyncio.wait_for(self._finished.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _speak(self, text):
+        self._finished.clear()
+        self._seen_playing = False
+        started = time.monotonic()
+        await self.speak(text)
+        now = time.monotonic()
+        latency = now - started
+        if self.tts_latency:
+            latency = self.tts_latency + self.smoothing * (latency - self.tts_latency)
+        self.tts_latency = latency
+        self._text = text
+        self._started_at = now
+        self._ends_at = now + len(text) / self.chars_per_second * self.safety_factor
+
+    async def _monitor(self, changes):
+        while True:
+            is_playing = await changes.get()
+            if is_playing:
+                self._seen_playing = True
+            elif self._seen_playing and not self._finished.is_set():
+                self._finished.set()
+                self._calibrate(time.monotonic() - self._started_at)
+
+    def _calibrate(self, duration):
+        if not self._text or duration <= 0.3:
+            return
+        rate = len(self._text) / duration
+        old = self.chars_per_second
+        SPEECH_RATES[self.hardware] = old + self.smoothing * (rate - old)
+        _LOGGER.debug(
+            "Speech rate of %s: %.2f chars/s", self.hardware, SPEECH_RATES[self.hardware]
+        )